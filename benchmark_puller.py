@@ -0,0 +1,81 @@
+"""
+Benchmarks the puller against the local XIVAPI stand-in.
+"""
+import argparse
+import json
+import logging
+import tempfile
+import time
+import fake_xivapi
+import pull_data
+import throttle
+
+def parse_args():
+    """
+    Parses command line arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    fake_xivapi.add_stand_in_arguments(parser)
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='benchmark the streaming mode of the puller'
+    )
+    parser.add_argument(
+        '--names',
+        action='store_true',
+        help='include pulling item names in the benchmark'
+    )
+    parser.add_argument(
+        '--rate-limit',
+        type=float,
+        default=throttle.RATE_LIMIT,
+        help='requests per second the puller allows itself'
+    )
+    parser.add_argument('--report', help='file to write the benchmark results to as JSON')
+    return parser.parse_args()
+
+def main():
+    """
+    Main function that runs the puller against the stand-in and reports how it performed.
+    """
+    args = parse_args()
+    logging.getLogger('tornado.access').setLevel(logging.ERROR)
+    stand_in = fake_xivapi.stand_in_from_args(args)
+    url, stop = fake_xivapi.serve_in_background(stand_in)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            puller = pull_data.Puller(
+                xivapi_url=url,
+                data_dir=directory,
+                rate_limiter=throttle.TokenBucket(args.rate_limit, max(1, args.rate_limit))
+            )
+            started = time.perf_counter()
+            dataset = puller.pull(force=True, stream=args.stream, names=args.names)
+            wall_time = time.perf_counter() - started
+    finally:
+        stop()
+    stats = puller.fetcher.session.stats()
+    results = {
+        'wall_seconds': round(wall_time, 3),
+        'requests': stats['requests'],
+        'requests_per_second': round(stats['requests'] / wall_time, 1),
+        'retries': stats['retries'],
+        'rate_limited': stand_in.counts['rate_limited'],
+        'server_errors': stand_in.counts['server_errors'],
+        'connections_opened': stats['connections_opened'],
+        'wire_bytes': stats['wire_bytes'],
+        'decoded_bytes': stats['decoded_bytes'],
+        'records': dict(dataset.counts),
+        'run_report': dataset.report
+    }
+    print(f'Wall time: {results["wall_seconds"]}s')
+    print(f'Requests: {results["requests"]} ({results["requests_per_second"]}/s)')
+    print(f'Retries: {results["retries"]} '
+          f'({results["rate_limited"]} rate limited, {results["server_errors"]} server errors)')
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(results, indent=2, default=dict))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Recorded XIVAPI responses that a pull can be replayed from without touching the network.
+"""
+import hashlib
+import json
+import os
+from urllib.parse import urlsplit
+from page_cache import write_atomically
+
+class CassetteMiss(LookupError):
+    """
+    Raised when replaying a response that was never recorded.
+    """
+
+class Cassette:
+    """
+    Stores every response a pull receives, one file per URL and cursor, grouped in a directory
+    per sheet. Responses are keyed by path and query only, so a cassette recorded against one
+    XIVAPI host can be replayed against any other.
+    """
+    def __init__(self, root, replaying=False):
+        self.root = root
+        self.replaying = replaying
+        if replaying and not os.path.isdir(root):
+            raise FileNotFoundError(f'No cassette at {root}')
+
+    def response_path(self, url, cursor):
+        """
+        Finds the path a response is recorded at.
+        """
+        parts = urlsplit(url)
+        key = hashlib.sha256(f'{parts.path}?{parts.query}\n{cursor}'.encode('utf-8')).hexdigest()
+        directory = parts.path.rstrip('/').rsplit('/', 1)[-1]
+        return os.path.join(self.root, directory, f'{cursor}-{key[:16]}.json')
+
+    def get(self, url, cursor):
+        """
+        Replays a recorded response.
+        """
+        path = self.response_path(url, cursor)
+        if not os.path.exists(path):
+            raise CassetteMiss(f'No recorded response for {url} from {cursor}')
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def put(self, url, cursor, response):
+        """
+        Records a response.
+        """
+        path = self.response_path(url, cursor)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomically(path, json.dumps(response))
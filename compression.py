@@ -0,0 +1,71 @@
+"""
+Pre-compressed siblings of the data files, such as mining.json.gz, written once at build time.
+"""
+import gzip
+import os
+import threading
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMATS = ('gz', 'br', 'zst')
+DECOMPRESSION_PREFERENCE = ('zst', 'br', 'gz')
+LIBRARIES = {'br': 'brotli', 'zst': 'zstandard'}
+
+def is_available(compression):
+    """
+    Checks whether the library for a compression format is installed.
+    """
+    return compression == 'gz' or (
+        compression == 'br' and brotli is not None
+    ) or (
+        compression == 'zst' and zstandard is not None
+    )
+
+def compress(data, compression):
+    """
+    Compresses bytes at the format's maximum level. Gzip output leaves out the modification
+    time, so the same data always compresses to the same bytes.
+    """
+    if compression == 'gz':
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if compression == 'br':
+        return brotli.compress(data, quality=11, lgwin=24)
+    if compression == 'zst':
+        return zstandard.ZstdCompressor(level=22).compress(data)
+    raise ValueError(f'Unknown compression format {compression}')
+
+def decompress(data, compression):
+    """
+    Decompresses bytes compressed in a format.
+    """
+    if compression == 'gz':
+        return gzip.decompress(data)
+    if compression == 'br':
+        return brotli.decompress(data)
+    if compression == 'zst':
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f'Unknown compression format {compression}')
+
+def write_compressed(path, compressions):
+    """
+    Writes a compressed sibling of a file in each format that it does not have one in yet.
+    """
+    missing = [
+        compression for compression in compressions
+        if not os.path.exists(f'{path}.{compression}')
+    ]
+    if not missing:
+        return
+    with open(path, 'rb') as f:
+        data = f.read()
+    for compression in missing:
+        temp_path = f'{path}.{compression}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(compress(data, compression))
+        os.replace(temp_path, f'{path}.{compression}')
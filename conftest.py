@@ -0,0 +1,75 @@
+"""
+Fixtures and helpers shared by the tests: stand-ins for XIVAPI, and pulling from them.
+"""
+import os
+import pytest
+from fake_xivapi import StandIn, generate_sheets, serve_in_background
+from pull_data import Puller
+from snapshots import current_snapshot
+
+SCALE = 0.05
+DATA_FILES = ('mining', 'botany', 'fishing', 'crafting', 'recipes', 'used_in')
+
+def pytest_configure(config):
+    """
+    Registers the marker that tags each test with the backlog request whose behaviour it covers.
+    """
+    config.addinivalue_line('markers', 'covers(request_id): the request a test covers')
+
+@pytest.fixture(scope='session', name='sheets')
+def fixture_sheets():
+    """
+    Generates the stand-ins' sheets once for every test.
+    """
+    return generate_sheets(SCALE)
+
+@pytest.fixture(name='serve')
+def fixture_serve(sheets):
+    """
+    Serves stand-ins made with the given settings until the test is done.
+    """
+    stops = []
+
+    def serve(**settings):
+        stand_in = StandIn(sheets, **settings)
+        url, stop = serve_in_background(stand_in)
+        stand_in.url = url
+        stops.append(stop)
+        return stand_in
+
+    yield serve
+    for stop in stops:
+        stop()
+
+@pytest.fixture(name='stand_in')
+def fixture_stand_in(serve):
+    """
+    Serves a stand-in of its own to each test.
+    """
+    return serve()
+
+def pull(data_dir, force=False, **options):
+    """
+    Pulls data into a data directory and publishes it, returning the dataset.
+    """
+    stream = options.pop('stream', False)
+    joined_gathering = options.pop('joined_gathering', False)
+    puller = Puller(data_dir=str(data_dir), max_attempts=2, **options)
+    try:
+        dataset = puller.pull(force, stream, joined_gathering)
+        if dataset.refreshed:
+            puller.save(dataset)
+        return dataset
+    finally:
+        puller.fetcher.session.close()
+
+def read_data_files(data_dir):
+    """
+    Reads the data files of the current snapshot.
+    """
+    snapshot = current_snapshot(str(data_dir))
+    data_files = {}
+    for output in DATA_FILES:
+        with open(os.path.join(snapshot, f'{output}.json'), 'rb') as f:
+            data_files[output] = f.read()
+    return data_files
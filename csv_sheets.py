@@ -0,0 +1,218 @@
+"""
+Sheets read from local datamining CSV exports, shaped like the rows XIVAPI returns.
+"""
+import csv
+import hashlib
+import os
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+VERSION_FILE = 'ffxivgame.ver'
+HEADER_LINES = 3
+LINKS = {
+    ('GatheringPointBase', 'Item'): 'GatheringItem',
+    ('GatheringPointBase', 'GatheringType'): 'GatheringType',
+    ('GatheringItem', 'Item'): 'Item',
+    ('GatheringItem', 'GatheringItemLevel'): 'GatheringItemLevelConvertTable',
+    ('FishingSpot', 'Item'): 'Item',
+    ('Recipe', 'CraftType'): 'CraftType',
+    ('Recipe', 'ItemResult'): 'Item',
+    ('Recipe', 'Ingredient'): 'Item',
+    ('Recipe', 'RecipeLevelTable'): 'RecipeLevelTable'
+}
+COLUMN_ALIASES = {'ItemIngredient': 'Ingredient'}
+FLOAT_TYPES = ('single', 'double', 'float')
+
+def column_name(name):
+    """
+    Turns a datamining column name into the name XIVAPI gives the field, such as Item{Result}
+    into ItemResult, or Item{Ingredient}[0] into Ingredient[0] where the names differ.
+    """
+    name, bracket, index = name.replace('{', '').replace('}', '').partition('[')
+    return COLUMN_ALIASES.get(name, name) + bracket + index
+
+def convert_column(values, column_type):
+    """
+    Converts a column of strings to the values XIVAPI would give for the column's type: strings,
+    booleans, floats, or integers for numbers and links to other sheets.
+    """
+    if column_type == 'str':
+        return list(values)
+    if column_type == 'bool' or column_type.startswith('bit'):
+        return [value == 'True' for value in values]
+    if column_type in FLOAT_TYPES:
+        return [float(value) if value else 0.0 for value in values]
+    return [int(value) if value else 0 for value in values]
+
+def read_table(path):
+    """
+    Reads a datamining CSV export column by column: the row ids, the columns by name, and each
+    column's type. The first three lines hold column indexes, names and types. Rows are parsed
+    with pandas when it is installed, and with the csv module otherwise.
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        header = [next(csv.reader([f.readline()])) for _ in range(HEADER_LINES)]
+        if pandas is not None:
+            frame = pandas.read_csv(
+                f,
+                header=None,
+                dtype=str,
+                keep_default_na=False,
+                names=range(len(header[1]))
+            )
+            raw_columns = [frame[index].tolist() for index in range(len(header[1]))]
+        else:
+            raw_columns = [list(column) for column in zip(*csv.reader(f))]
+    if not raw_columns:
+        raw_columns = [[] for _ in header[1]]
+    names = [column_name(name) for name in header[1]]
+    return {
+        'row_ids': [int(row_id) for row_id in raw_columns[0]],
+        'raw_columns': dict(zip(names[1:], raw_columns[1:])),
+        'types': dict(zip(names[1:], header[2][1:])),
+        'columns': {}
+    }
+
+def field_tree(fields):
+    """
+    Turns XIVAPI field paths, such as Item[].GatheringItemLevel.value, into a tree of the fields
+    to read from each sheet.
+    """
+    tree = {}
+    for field in fields:
+        node = tree
+        for segment in field.split('.'):
+            node = node.setdefault(segment, {})
+    return tree
+
+class CsvSheets:
+    """
+    Reads sheets from a directory of datamining CSV exports, such as Recipe.csv, and builds rows
+    shaped like the rows XIVAPI returns for the same fields, with references to other sheets
+    expanded the same way. Names in a language other than English are read from exports such
+    as Item.ja.csv. Each table is read once.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+
+    def game_version(self):
+        """
+        Reads the game version the exports were made from, or, without a version file, derives
+        one from the exports' contents.
+        """
+        version_path = os.path.join(self.directory, VERSION_FILE)
+        if os.path.exists(version_path):
+            with open(version_path, 'r', encoding='utf-8') as f:
+                return f.read().strip()
+        digest = hashlib.sha256()
+        for file_name in sorted(os.listdir(self.directory)):
+            if file_name.endswith('.csv'):
+                with open(os.path.join(self.directory, file_name), 'rb') as f:
+                    digest.update(file_name.encode('utf-8'))
+                    digest.update(hashlib.sha256(f.read()).digest())
+        return f'csv-{digest.hexdigest()[:12]}'
+
+    def table(self, sheet_name, language=None):
+        """
+        Reads a sheet's export, in a language if one is given.
+        """
+        key = (sheet_name, language)
+        if key not in self.tables:
+            file_name = f'{sheet_name}.csv'
+            if language is not None and language != 'en':
+                file_name = f'{sheet_name}.{language}.csv'
+            path = os.path.join(self.directory, file_name)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f'No {file_name} export in {self.directory}')
+            table = read_table(path)
+            table['positions'] = {row_id: index for index, row_id in enumerate(table['row_ids'])}
+            self.tables[key] = table
+        return self.tables[key]
+
+    def column(self, sheet_name, name, language=None):
+        """
+        Retrieves a converted column of a sheet, converting it on first use.
+        """
+        table = self.table(sheet_name, language)
+        if name not in table['columns']:
+            if name not in table['raw_columns']:
+                raise KeyError(f'{sheet_name} export has no column {name}')
+            table['columns'][name] = convert_column(
+                table['raw_columns'][name],
+                table['types'][name]
+            )
+        return table['columns'][name]
+
+    def rows(self, sheet_name, fields, row_ids=None):
+        """
+        Builds rows of a sheet with the given XIVAPI fields, for every row or only the given
+        row ids, in row id order.
+        """
+        table = self.table(sheet_name)
+        tree = field_tree(fields)
+        if row_ids is None:
+            row_ids = table['row_ids']
+        else:
+            row_ids = sorted(row_id for row_id in row_ids if row_id in table['positions'])
+        return [
+            {'row_id': row_id, 'fields': self.build_fields(sheet_name, row_id, tree)}
+            for row_id in row_ids
+        ]
+
+    def build_fields(self, sheet_name, row_id, tree):
+        """
+        Builds the fields of a row from a field tree. Array fields, such as Item[], gather the
+        numbered columns Item[0], Item[1] and so on.
+        """
+        fields = {}
+        for segment, subtree in tree.items():
+            if segment.lower() == 'value':
+                continue
+            name, _, decorator = segment.partition('@')
+            language = decorator[len('lang('):-1] if decorator.startswith('lang(') else None
+            if name.endswith('[]'):
+                name = name[:-2]
+                table = self.table(sheet_name, language)
+                count = 0
+                while f'{name}[{count}]' in table['raw_columns']:
+                    count += 1
+                fields[name + segment[len(name) + 2:]] = [
+                    self.build_value(
+                        sheet_name,
+                        f'{name}[{index}]',
+                        name,
+                        row_id,
+                        subtree,
+                        language
+                    )
+                    for index in range(count)
+                ]
+            else:
+                fields[segment] = self.build_value(
+                    sheet_name,
+                    name,
+                    name,
+                    row_id,
+                    subtree,
+                    language
+                )
+        return fields
+
+    def build_value(self, sheet_name, column, name, row_id, subtree, language):
+        """
+        Builds a field's value: the column's value itself, or when fields of it are asked for,
+        a reference to the row it links to, expanded with those fields.
+        """
+        table = self.table(sheet_name, language)
+        value = self.column(sheet_name, column, language)[table['positions'][row_id]]
+        if not subtree:
+            return value
+        target = LINKS.get((sheet_name, name), table['types'][column])
+        target_fields = {}
+        if any(segment.lower() != 'value' for segment in subtree):
+            if value in self.table(target)['positions']:
+                target_fields = self.build_fields(target, value, subtree)
+        return {'value': value, 'sheet': target, 'row_id': value, 'fields': target_fields}
@@ -0,0 +1,66 @@
+"""
+Immutable results of a pull of crafting and gathering data.
+"""
+from collections import namedtuple
+from types import MappingProxyType
+
+def freeze(data):
+    """
+    Makes a read-only copy of JSON-like data, turning dicts into mapping proxies and lists into
+    tuples.
+    """
+    if isinstance(data, dict):
+        return MappingProxyType({key: freeze(value) for key, value in data.items()})
+    if isinstance(data, list):
+        return tuple(freeze(value) for value in data)
+    return data
+
+class Dataset(namedtuple(
+    'Dataset',
+    [
+        'game_version',
+        'schema',
+        'outputs',
+        'counts',
+        'refreshed',
+        'streamed',
+        'snapshot',
+        'report'
+    ]
+)):
+    """
+    Holds what a pull produced: the game version and schema it was pulled from, the frozen
+    records of each data file, how many records each data file has, and which data files were
+    pulled again rather than reused. Data files that were streamed to disk are counted but their
+    records are not held. The snapshot is the directory the data files are written to, or None
+    if nothing was pulled again, and the report describes how the pull went.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def build(
+        cls,
+        game_version,
+        schema,
+        outputs,
+        counts,
+        refreshed,
+        streamed,
+        snapshot,
+        report
+    ):
+        """
+        Builds a dataset, freezing the given records.
+        """
+        return cls(
+            game_version,
+            schema,
+            MappingProxyType({
+                output: freeze(data) for output, data in outputs.items() if output not in streamed
+            }),
+            MappingProxyType(dict(counts)),
+            frozenset(refreshed),
+            frozenset(streamed),
+            snapshot,
+            freeze(report)
+        )
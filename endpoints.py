@@ -0,0 +1,144 @@
+"""
+Equivalent XIVAPI endpoints, such as mirrors or a local caching proxy, chosen by latency and health.
+"""
+import threading
+import time
+from collections import deque
+from run_report import percentile
+
+LATENCY_WINDOW = 100
+MAX_ERROR_RATE = 0.25
+HEDGE_PERCENTILE = 95
+MIN_HEDGE_SAMPLES = 10
+SAMPLE_MAX_AGE = 60.0
+
+class Endpoint:
+    """
+    Tracks the latency and outcome of an endpoint's most recent requests. Samples older than
+    the maximum age are forgotten, so an endpoint that has not been used for a while is judged
+    afresh by its next request, its trial.
+    """
+    def __init__(self, url, window=LATENCY_WINDOW, max_age=SAMPLE_MAX_AGE):
+        self.url = url.rstrip('/')
+        self.max_age = max_age
+        self.latencies = deque(maxlen=window)
+        self.failures = deque(maxlen=window)
+        self.on_trial = False
+        self.lock = threading.Lock()
+
+    def record(self, latency, failed):
+        """
+        Records a request's latency and whether it failed, which ends any trial. Only answered
+        requests count towards latency.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.failures.append((now, failed))
+            if not failed:
+                self.latencies.append((now, latency))
+            self.on_trial = False
+
+    def expire(self):
+        """
+        Forgets samples older than the maximum age. Callers hold the lock.
+        """
+        oldest = time.monotonic() - self.max_age
+        for samples in (self.latencies, self.failures):
+            while samples and samples[0][0] < oldest:
+                samples.popleft()
+
+    def start_trial(self):
+        """
+        Claims the trial of an endpoint with no recent requests, so that only one request at a
+        time measures it. Returns whether the trial was claimed.
+        """
+        with self.lock:
+            self.expire()
+            if self.failures or self.on_trial:
+                return False
+            self.on_trial = True
+            return True
+
+    def error_rate(self):
+        """
+        Finds the fraction of recent requests that failed.
+        """
+        with self.lock:
+            self.expire()
+            if not self.failures:
+                return 0.0
+            return sum(failed for _, failed in self.failures) / len(self.failures)
+
+    def mean_latency(self):
+        """
+        Finds the mean of recent latencies, or None while the endpoint has no recent answers.
+        """
+        with self.lock:
+            self.expire()
+            if not self.latencies:
+                return None
+            return sum(latency for _, latency in self.latencies) / len(self.latencies)
+
+    def latency(self, rank, min_samples=1):
+        """
+        Finds a percentile of recent latencies, or None with fewer samples than the minimum.
+        """
+        with self.lock:
+            self.expire()
+            if len(self.latencies) < min_samples:
+                return None
+            return percentile(sorted(latency for _, latency in self.latencies), rank)
+
+class EndpointPool:
+    """
+    Chooses between equivalent endpoints. Each request goes to the healthy endpoint with the
+    lowest mean latency, which unlike the median counts an endpoint's slow tail against it.
+    An endpoint without recent requests is given a single trial request first, so that every
+    endpoint gets measured, and since samples expire, slow and unhealthy endpoints that stop
+    being chosen are measured again once theirs have. An endpoint is unhealthy while more than
+    a quarter of its recent requests failed or while it is blocked, such as by an open circuit
+    breaker; when none is healthy, the one failing least is chosen.
+    """
+    def __init__(self, urls, max_age=SAMPLE_MAX_AGE):
+        self.endpoints = [Endpoint(url, max_age=max_age) for url in urls]
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def find(self, url):
+        """
+        Finds the endpoint that a request URL was sent to, or None.
+        """
+        for endpoint in self.endpoints:
+            if url is not None and url.startswith(endpoint.url):
+                return endpoint
+        return None
+
+    def choose(self, exclude=(), is_blocked=lambda endpoint: False):
+        """
+        Chooses the best endpoint that is not excluded, or None if every endpoint is.
+        """
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+        if not candidates:
+            return None
+        healthy = [
+            endpoint for endpoint in candidates
+            if endpoint.error_rate() <= MAX_ERROR_RATE and not is_blocked(endpoint)
+        ]
+        if not healthy:
+            return min(candidates, key=lambda endpoint: endpoint.error_rate())
+        for endpoint in healthy:
+            if endpoint.start_trial():
+                return endpoint
+        measured = [endpoint for endpoint in healthy if endpoint.mean_latency() is not None]
+        return min(measured or healthy, key=lambda endpoint: endpoint.mean_latency() or 0.0)
+
+    def hedge_delay(self, endpoint):
+        """
+        Finds how long to wait for an endpoint before hedging a request to another one: its
+        95th percentile latency, once it has answered enough requests to tell, else None.
+        Without a second endpoint there is nothing to hedge to.
+        """
+        if len(self.endpoints) < 2:
+            return None
+        return endpoint.latency(HEDGE_PERCENTILE, MIN_HEDGE_SAMPLES)
@@ -0,0 +1,454 @@
+"""
+Runs a local stand-in for the XIVAPI sheet endpoints, with injectable latency and errors.
+"""
+# pylint: disable=abstract-method
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import random
+import threading
+import tornado.httpserver
+import tornado.netutil
+from tornado.web import Application, RequestHandler
+
+GAME_VERSION = '7.0-stand-in'
+SCHEMA = 'exdschema@stand-in'
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+CRAFT_TYPES = [
+    'Carpenter',
+    'Blacksmith',
+    'Armorer',
+    'Goldsmith',
+    'Leatherworker',
+    'Weaver',
+    'Alchemist',
+    'Culinarian'
+]
+ITEM_NAME_WORDS = {
+    'en': (
+        ['Copper', 'Iron', 'Mythril', 'Cobalt', 'Darksteel'],
+        ['Ore', 'Ingot', 'Sand', 'Log']
+    ),
+    'ja': (
+        ['銅', '鉄', 'ミスリル', 'コバルト', 'ダークスチール'],
+        ['鉱', 'インゴット', '砂', '材木']
+    ),
+    'de': (
+        ['Kupfer', 'Eisen', 'Mithril', 'Kobalt', 'Dunkelstahl'],
+        ['erz', 'barren', 'sand', 'holz']
+    ),
+    'fr': (
+        ['cuivre', 'fer', 'mithril', 'cobalt', 'acier sombre'],
+        ['Minerai', 'Lingot', 'Sable', 'Rondin']
+    )
+}
+SHEET_SIZES = {
+    'GatheringItemLevelConvertTable': 800,
+    'GatheringItem': 4000,
+    'GatheringPointBase': 1000,
+    'FishingSpot': 300,
+    'Recipe': 35000
+}
+INGREDIENT_SLOTS = 8
+CRYSTAL_IDS = range(2, 20)
+
+def reference(sheet_name, row_id, fields=None):
+    """
+    Builds a reference to a row of another sheet, optionally expanded with its fields.
+    """
+    return {
+        'value': row_id,
+        'sheet': sheet_name,
+        'row_id': row_id,
+        'fields': fields if fields is not None else {}
+    }
+
+def generate_sheets(scale=1.0, seed=0):
+    """
+    Generates synthetic sheets shaped like the ones the puller reads, with references expanded.
+    """
+    rng = random.Random(seed)
+    sizes = {name: max(2, int(size * scale)) for name, size in SHEET_SIZES.items()}
+    sheets = {}
+    sheets['GatheringItemLevelConvertTable'] = [
+        {
+            'row_id': row_id,
+            'fields': {'GatheringItemLevel': min(100, row_id), 'Stars': row_id // 600}
+        }
+        for row_id in range(sizes['GatheringItemLevelConvertTable'])
+    ]
+    sheets['GatheringItem'] = [
+        {
+            'row_id': row_id,
+            'fields': {
+                'Item': reference('Item', 0 if row_id == 0 else 5000 + row_id),
+                'GatheringItemLevel': reference(
+                    'GatheringItemLevelConvertTable',
+                    rng.randrange(sizes['GatheringItemLevelConvertTable'])
+                )
+            }
+        }
+        for row_id in range(sizes['GatheringItem'])
+    ]
+    for gathering_item in sheets['GatheringItem']:
+        level = gathering_item['fields']['GatheringItemLevel']
+        level['fields'] = sheets['GatheringItemLevelConvertTable'][level['value']]['fields']
+    sheets['GatheringPointBase'] = []
+    for row_id in range(sizes['GatheringPointBase']):
+        item_references = []
+        for _ in range(8):
+            gathering_item_id = rng.randrange(-sizes['GatheringItem'], sizes['GatheringItem'])
+            gathering_item_id = max(0, gathering_item_id)
+            item_references.append(reference(
+                'GatheringItem',
+                gathering_item_id,
+                sheets['GatheringItem'][gathering_item_id]['fields']
+            ))
+        sheets['GatheringPointBase'].append({
+            'row_id': row_id,
+            'fields': {
+                'GatheringType': reference('GatheringType', row_id % 6),
+                'GatheringLevel': 1 + row_id % 100,
+                'Item': item_references
+            }
+        })
+    sheets['FishingSpot'] = [
+        {
+            'row_id': row_id,
+            'fields': {
+                'GatheringLevel': 1 + row_id % 100,
+                'Item': [
+                    reference('Item', rng.choice([0, 0, rng.randrange(1, 40000)]))
+                    for _ in range(10)
+                ]
+            }
+        }
+        for row_id in range(sizes['FishingSpot'])
+    ]
+    sheets['Recipe'] = []
+    row_id = 0
+    for _ in range(sizes['Recipe']):
+        row_id += rng.choice([1, 1, 1, 1, 1, 1, 1, 1, 2, 5])
+        level = rng.randrange(1, 101)
+        craft_type = rng.randrange(len(CRAFT_TYPES))
+        sheets['Recipe'].append({
+            'row_id': row_id,
+            'fields': {
+                'CraftType': reference('CraftType', craft_type, {'Name': CRAFT_TYPES[craft_type]}),
+                'ItemResult': reference('Item', 0 if row_id % 97 == 0 else 10000 + row_id),
+                'AmountResult': rng.choice([1, 1, 1, 3]),
+                'RecipeLevelTable': reference('RecipeLevelTable', level, {'ClassJobLevel': level})
+            }
+        })
+    add_ingredients(sheets, rng)
+    item_ids = set()
+    for gathering_item in sheets['GatheringItem']:
+        item_ids.add(gathering_item['fields']['Item']['value'])
+    for fishing_spot in sheets['FishingSpot']:
+        item_ids.update(item['value'] for item in fishing_spot['fields']['Item'])
+    for recipe in sheets['Recipe']:
+        item_ids.add(recipe['fields']['ItemResult']['value'])
+        item_ids.update(ingredient['value'] for ingredient in recipe['fields']['Ingredient'])
+    sheets['Item'] = [
+        {
+            'row_id': item_id,
+            'fields': {'Name': item_name('en', item_id)},
+            'languages': {
+                language: {'Name': item_name(language, item_id)} for language in ITEM_NAME_WORDS
+            }
+        }
+        for item_id in sorted(item_ids - {0})
+    ]
+    return sheets
+
+def add_ingredients(sheets, rng):
+    """
+    Gives each recipe a crystal and a few ingredients, drawn from gathered items and the results
+    of earlier recipes so that recipes nest without cycles, padded with empty slots.
+    """
+    gathered_ids = [
+        gathering_item['fields']['Item']['value'] for gathering_item in sheets['GatheringItem'][1:]
+    ]
+    result_ids = []
+    for recipe in sheets['Recipe']:
+        ingredients = [(rng.choice(CRYSTAL_IDS), rng.randrange(1, 4))]
+        for _ in range(rng.randrange(1, 5)):
+            if result_ids and rng.random() < 0.3:
+                ingredient_id = rng.choice(result_ids)
+            else:
+                ingredient_id = rng.choice(gathered_ids)
+            ingredients.append((ingredient_id, rng.randrange(1, 6)))
+        ingredients += [(0, 0)] * (INGREDIENT_SLOTS - len(ingredients))
+        recipe['fields']['Ingredient'] = [reference('Item', item_id) for item_id, _ in ingredients]
+        recipe['fields']['AmountIngredient'] = [amount for _, amount in ingredients]
+        if recipe['fields']['ItemResult']['value'] != 0:
+            result_ids.append(recipe['fields']['ItemResult']['value'])
+
+def item_name(language, item_id):
+    """
+    Builds a synthetic item name in a language, shared by items with the same id pattern.
+    """
+    materials, forms = ITEM_NAME_WORDS[language]
+    material = materials[item_id % len(materials)]
+    form = forms[item_id // len(materials) % len(forms)]
+    if language == 'en':
+        return f'{material} {form}'
+    if language == 'fr':
+        return f'{form} de {material}'
+    return f'{material}{form}'
+
+def load_cassette_sheets(root):
+    """
+    Collects the rows of every sheet recorded in a cassette directory.
+    """
+    sheets = {}
+    for sheet_name in os.listdir(root):
+        directory = os.path.join(root, sheet_name)
+        if sheet_name == 'version' or not os.path.isdir(directory):
+            continue
+        rows = {}
+        for file_name in os.listdir(directory):
+            with open(os.path.join(directory, file_name), 'r', encoding='utf-8') as f:
+                for row in json.load(f)['rows']:
+                    rows[row['row_id']] = row
+        sheets[sheet_name] = [rows[row_id] for row_id in sorted(rows)]
+    return sheets
+
+def select_fields(row, fields):
+    """
+    Trims a row down to the top-level fields named in a fields parameter. Fields with a
+    language decorator, such as Name@lang(ja), are read from the row's names in that language
+    and keep the decorator in their key.
+    """
+    if not fields:
+        return row
+    names = {field.split('.')[0].split('[')[0] for field in fields}
+    unlocalized = {
+        name.split('@')[0] for name in names if not name.partition('@')[2].startswith('lang(')
+    }
+    selected = {
+        name: value for name, value in row['fields'].items()
+        if name in names or name in unlocalized
+    }
+    for name in names:
+        base, _, decorator = name.partition('@')
+        if decorator.startswith('lang(') and name not in selected:
+            language = decorator[len('lang('):-1]
+            localized = row.get('languages', {}).get(language, row['fields'])
+            if base in localized:
+                selected[name] = localized[base]
+    return {'row_id': row['row_id'], 'fields': selected}
+
+class StandIn:
+    """
+    Holds the stand-in's sheets, its fault injection settings, and counts of what it served.
+    Failing pages, given as (sheet name, after) with None for a sheet's first page, are always
+    answered with 503. Without a game version, only the latest version is listed.
+    """
+    def __init__(
+        self,
+        sheets,
+        latency=0.0,
+        jitter=0.0,
+        rate_limited=0.0,
+        server_errors=0.0,
+        retry_after=1,
+        seed=0,
+        failing_pages=(),
+        game_version=GAME_VERSION,
+        schema=SCHEMA
+    ):
+        self.sheets = sheets
+        self.row_ids = {name: [row['row_id'] for row in rows] for name, rows in sheets.items()}
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limited = rate_limited
+        self.server_errors = server_errors
+        self.retry_after = retry_after
+        self.failing_pages = set(failing_pages)
+        self.game_version = game_version
+        self.schema = schema
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'rate_limited': 0, 'server_errors': 0}
+
+    def count(self, name):
+        """
+        Counts an event.
+        """
+        with self.lock:
+            self.counts[name] += 1
+
+    async def admit(self, handler):
+        """
+        Delays a request by the configured latency, then decides whether to fail it. Returns
+        whether the request should be served.
+        """
+        self.count('requests')
+        with self.lock:
+            delay = max(0.0, self.rng.gauss(self.latency, self.jitter))
+            roll = self.rng.random()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if roll < self.rate_limited:
+            self.count('rate_limited')
+            handler.set_status(429)
+            handler.set_header('Retry-After', str(self.retry_after))
+            handler.finish()
+            return False
+        if roll > 1 - self.server_errors:
+            self.count('server_errors')
+            handler.set_status(503)
+            handler.finish()
+            return False
+        return True
+
+class VersionHandler(RequestHandler):
+    """
+    Request handler for the game version list.
+    """
+    def initialize(self, stand_in):
+        """
+        Attaches the stand-in.
+        """
+        self.stand_in = stand_in # pylint: disable=attribute-defined-outside-init
+
+    async def get(self):
+        """
+        Retrieves the game versions the stand-in serves.
+        """
+        if await self.stand_in.admit(self):
+            names = [name for name in (self.stand_in.game_version, 'latest') if name is not None]
+            self.write({'versions': [{'names': names}]})
+
+class SheetHandler(RequestHandler):
+    """
+    Request handler for sheet rows, paged with after and limit or selected with rows.
+    """
+    def initialize(self, stand_in):
+        """
+        Attaches the stand-in.
+        """
+        self.stand_in = stand_in # pylint: disable=attribute-defined-outside-init
+
+    async def get(self, sheet_name):
+        """
+        Retrieves rows from a sheet.
+        """
+        if not await self.stand_in.admit(self):
+            return
+        if sheet_name not in self.stand_in.sheets:
+            self.set_status(404)
+            self.write({'code': 404, 'message': f'Unknown sheet {sheet_name}'})
+            return
+        if (sheet_name, self.get_argument('after', None)) in self.stand_in.failing_pages:
+            self.stand_in.count('server_errors')
+            self.set_status(503)
+            return
+        rows = self.stand_in.sheets[sheet_name]
+        row_ids = self.stand_in.row_ids[sheet_name]
+        fields = [field for field in self.get_argument('fields', '').split(',') if field]
+        if self.get_argument('rows', None) is not None:
+            selected = []
+            for row_id in self.get_argument('rows').split(','):
+                index = bisect.bisect_left(row_ids, int(row_id))
+                if index < len(row_ids) and row_ids[index] == int(row_id):
+                    selected.append(rows[index])
+        else:
+            limit = min(int(self.get_argument('limit', str(DEFAULT_LIMIT))), MAX_LIMIT)
+            after = self.get_argument('after', None)
+            start = 0 if after is None else bisect.bisect_right(row_ids, int(after))
+            selected = rows[start:start + limit]
+        self.write({
+            'schema': self.stand_in.schema,
+            'rows': [select_fields(row, fields) for row in selected]
+        })
+
+def make_application(stand_in):
+    """
+    Builds the stand-in's web application.
+    """
+    return Application(
+        [
+            (r'^/api/1/version$', VersionHandler, {'stand_in': stand_in}),
+            (r'^/api/1/sheet/([^/]+)$', SheetHandler, {'stand_in': stand_in}),
+        ],
+        compress_response=True
+    )
+
+def serve_in_background(stand_in, port=0):
+    """
+    Serves the stand-in from a background thread. Returns its base URL and a function that stops
+    it.
+    """
+    sockets = tornado.netutil.bind_sockets(port, '127.0.0.1')
+    port = sockets[0].getsockname()[1]
+    loop = asyncio.new_event_loop()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        http_server = tornado.httpserver.HTTPServer(make_application(stand_in))
+        http_server.add_sockets(sockets)
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    return f'http://127.0.0.1:{port}', lambda: loop.call_soon_threadsafe(loop.stop)
+
+def add_stand_in_arguments(parser):
+    """
+    Adds the arguments that configure a stand-in to an argument parser.
+    """
+    parser.add_argument('--cassette', help='serve rows recorded in a cassette directory')
+    parser.add_argument('--scale', type=float, default=1.0, help='scale of the synthetic sheets')
+    parser.add_argument('--seed', type=int, default=0, help='seed for synthetic rows and faults')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='latency deviation in seconds')
+    parser.add_argument('--rate-limited', type=float, default=0.0, help='fraction of 429s')
+    parser.add_argument('--server-errors', type=float, default=0.0, help='fraction of 503s')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After on 429s')
+    parser.add_argument(
+        '--fail-page',
+        metavar='SHEET:AFTER',
+        action='append',
+        default=[],
+        help='always answer the page of a sheet after a row_id with 503; can be given more '
+             'than once'
+    )
+
+def stand_in_from_args(args):
+    """
+    Builds a stand-in from parsed arguments.
+    """
+    if args.cassette:
+        sheets = load_cassette_sheets(args.cassette)
+    else:
+        sheets = generate_sheets(args.scale, args.seed)
+    return StandIn(
+        sheets,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limited=args.rate_limited,
+        server_errors=args.server_errors,
+        retry_after=args.retry_after,
+        seed=args.seed,
+        failing_pages=[tuple(page.split(':', 1)) for page in args.fail_page]
+    )
+
+async def main():
+    """
+    Main function that starts the stand-in server.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=1415, help='port to listen on')
+    add_stand_in_arguments(parser)
+    args = parser.parse_args()
+    http_server = tornado.httpserver.HTTPServer(make_application(stand_in_from_args(args)))
+    http_server.listen(args.port, '127.0.0.1')
+    print(f'Serving XIVAPI stand-in on http://127.0.0.1:{args.port}')
+    await asyncio.Event().wait()
+
+if __name__=='__main__':
+    asyncio.run(main())
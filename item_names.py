@@ -0,0 +1,68 @@
+"""
+Item names in several languages, dictionary-encoded into one table of distinct strings.
+"""
+import json
+
+LANGUAGES = ('en', 'ja', 'de', 'fr')
+
+def name_field(language):
+    """
+    Builds the XIVAPI field that reads an item's name in a language.
+    """
+    return f'Name@lang({language})'
+
+class StringTable:
+    """
+    Interns strings, giving each distinct string a single index in a shared list.
+    """
+    def __init__(self):
+        self.strings = []
+        self.indexes = {}
+
+    def intern(self, string):
+        """
+        Retrieves the index of a string, adding it to the table if it is new.
+        """
+        index = self.indexes.get(string)
+        if index is None:
+            index = len(self.strings)
+            self.indexes[string] = index
+            self.strings.append(string)
+        return index
+
+def encode_names(rows, languages=LANGUAGES):
+    """
+    Encodes the names of Item rows as {'languages', 'strings', 'items'}, where items maps each
+    item id to the index in strings of its name in each language, in the order of languages.
+    Names shared between items or languages are stored once.
+    """
+    table = StringTable()
+    items = {}
+    for row in sorted(rows, key=lambda row: row['row_id']):
+        items[row['row_id']] = [
+            table.intern(row['fields'][name_field(language)]) for language in languages
+        ]
+    return {'languages': list(languages), 'strings': table.strings, 'items': items}
+
+def read_names(path):
+    """
+    Reads encoded names from a data file.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return decode_names(json.load(f))
+
+def decode_names(names):
+    """
+    Turns the item ids of encoded names read from JSON back into integers.
+    """
+    names['items'] = {int(item_id): indexes for item_id, indexes in names['items'].items()}
+    return names
+
+def get_name(names, item_id, language):
+    """
+    Looks up an item's name in a language in encoded names, or None if the item has none.
+    """
+    indexes = names['items'].get(item_id)
+    if indexes is None:
+        return None
+    return names['strings'][indexes[list(names['languages']).index(language)]]
@@ -0,0 +1,103 @@
+"""
+Incremental JSON writers for streaming pulled records straight to output files.
+"""
+import json
+import os
+import shutil
+import tempfile
+
+class JsonArrayWriter:
+    """
+    Writes a JSON array one record at a time, producing the same text as json.dumps would for the
+    whole list. The file is written under a temporary name and renamed into place when closed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = f'{path}.tmp'
+        self.file = open(self.temp_path, 'w', encoding='utf-8') # pylint: disable=consider-using-with
+        self.file.write('[')
+        self.count = 0
+
+    def write(self, record):
+        """
+        Appends a record to the array.
+        """
+        if self.count > 0:
+            self.file.write(', ')
+        self.file.write(json.dumps(record))
+        self.count += 1
+
+    def close(self):
+        """
+        Finishes the array and moves the file into place.
+        """
+        self.file.write(']')
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        """
+        Abandons the file without replacing the existing one.
+        """
+        self.file.close()
+        os.remove(self.temp_path)
+
+class JsonGroupedArrayWriter:
+    """
+    Writes a JSON object of arrays, such as crafting items by craft type, where records for
+    different keys arrive interleaved. Each key's array is spooled to a temporary file, and the
+    object is assembled when closed with keys in order of their first record, producing the same
+    text as json.dumps would for the whole dict.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.spools = {}
+        self.counts = {}
+        self.count = 0
+
+    def write(self, key, record):
+        """
+        Appends a record to the array for a key.
+        """
+        if key not in self.spools:
+            self.spools[key] = tempfile.TemporaryFile('w+', encoding='utf-8') # pylint: disable=consider-using-with
+            self.counts[key] = 0
+        elif self.counts[key] > 0:
+            self.spools[key].write(', ')
+        self.spools[key].write(json.dumps(record))
+        self.counts[key] += 1
+        self.count += 1
+
+    def close(self):
+        """
+        Assembles the spooled arrays into the output file and moves it into place.
+        """
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write('{')
+            for index, (key, spool) in enumerate(self.spools.items()):
+                if index > 0:
+                    f.write(', ')
+                f.write(f'{json.dumps(key)}: [')
+                spool.seek(0)
+                shutil.copyfileobj(spool, f)
+                f.write(']')
+            f.write('}')
+        self.discard()
+        os.replace(temp_path, self.path)
+
+    def discard(self):
+        """
+        Abandons the spooled arrays.
+        """
+        for spool in self.spools.values():
+            spool.close()
+        self.spools = {}
+
+def open_writer(path, grouped=False):
+    """
+    Opens an incremental writer for a JSON array, or for a JSON object of arrays when grouped.
+    """
+    if grouped:
+        return JsonGroupedArrayWriter(path)
+    return JsonArrayWriter(path)
@@ -0,0 +1,110 @@
+"""
+On-disk cache of XIVAPI pages, with per-sheet checkpoints so interrupted pulls can resume.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+from urllib.parse import urlsplit
+
+class PageCache:
+    """
+    Stores each page under a content address derived from its URL's path and query and its
+    cursor, within the namespace of the game version and schema it was served for. Every file
+    is written to a temporary name and renamed into place, so a crash never leaves a torn page
+    or checkpoint behind.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.checkpoint_file = os.path.join(root, 'checkpoints.json')
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.pages_dir = os.path.join(root, 'pages')
+        os.makedirs(self.pages_dir, exist_ok=True)
+        self.checkpoints = {}
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                self.checkpoints = json.load(f)
+
+    def use_namespace(self, namespace):
+        """
+        Caches pages in a namespace, such as a game version and schema, and removes the pages
+        and checkpoints of every other one.
+        """
+        key = hashlib.sha256(namespace.encode('utf-8')).hexdigest()[:16]
+        pages_dir = os.path.join(self.root, 'pages', key)
+        if not os.path.isdir(pages_dir):
+            self.clear_checkpoints()
+        for name in os.listdir(os.path.join(self.root, 'pages')):
+            if name != key:
+                shutil.rmtree(os.path.join(self.root, 'pages', name), ignore_errors=True)
+        os.makedirs(pages_dir, exist_ok=True)
+        self.pages_dir = pages_dir
+
+    def page_path(self, url, cursor):
+        """
+        Finds the path a page is cached at. Pages are keyed by path and query only, so a page
+        retrieved from one XIVAPI endpoint is served for any equivalent one.
+        """
+        parts = urlsplit(url)
+        key = hashlib.sha256(f'{parts.path}?{parts.query}\n{cursor}'.encode('utf-8')).hexdigest()
+        return os.path.join(self.pages_dir, key[:2], f'{key}.json')
+
+    def get(self, url, cursor):
+        """
+        Retrieves a cached page, or None if it has not been cached.
+        """
+        path = self.page_path(url, cursor)
+        if not os.path.exists(path):
+            with self.lock:
+                self.misses += 1
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            page = json.load(f)
+        with self.lock:
+            self.hits += 1
+        return page
+
+    def put(self, url, cursor, page):
+        """
+        Caches a page.
+        """
+        path = self.page_path(url, cursor)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomically(path, json.dumps(page))
+
+    def get_checkpoint(self, key):
+        """
+        Retrieves the last good cursor recorded for a sheet, or None if there is none.
+        """
+        with self.lock:
+            return self.checkpoints.get(key)
+
+    def set_checkpoint(self, key, cursor, complete=False):
+        """
+        Records the last good cursor for a sheet, and whether the sheet has been fully retrieved.
+        """
+        with self.lock:
+            self.checkpoints[key] = {'cursor': cursor, 'complete': complete}
+            write_atomically(self.checkpoint_file, json.dumps(self.checkpoints))
+
+    def clear_checkpoints(self):
+        """
+        Forgets every checkpoint once a pull has finished.
+        """
+        with self.lock:
+            self.checkpoints = {}
+            write_atomically(self.checkpoint_file, json.dumps(self.checkpoints))
+
+def write_atomically(path, text):
+    """
+    Writes text to a temporary file beside the path, then renames it over the path.
+    """
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
@@ -0,0 +1,522 @@
+"""
+Fetches the rows of XIVAPI sheets page by page through the page cache, cassette, throttles and
+endpoints, with retries, hedging and sharded pagination, or reads them from CSV exports.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from urllib.parse import parse_qs, urlsplit
+import requests
+from csv_sheets import CsvSheets
+from endpoints import EndpointPool
+from page_sizing import AdaptivePageSize
+from run_report import RunMetrics
+from throttle import (
+    AimdWindow,
+    CircuitBreaker,
+    TokenBucket,
+    backoff_delay,
+    parse_retry_after
+)
+from xivapi_session import XivapiSession
+
+SHARD_WORKERS = {'Recipe': 8, 'GatheringItem': 4}
+SHARD_PROBE_START = 1024
+ROW_BATCH_SIZE = 100
+ROW_WORKERS = 4
+HEDGE_WORKERS = 32
+REQUEST_TIMEOUT = 30
+MAX_ATTEMPTS = 10
+LATEST_VERSION = 'latest'
+
+class PageUnavailable(IOError):
+    """
+    Raised when a page could not be retrieved within the allowed attempts.
+    """
+
+class PageFetcher:
+    """
+    Fetches the rows of sheets from XIVAPI and its mirrors, or reads them from CSV exports.
+
+    A fetcher keeps its HTTP session, page cache, cassette, throttles, circuit breakers and page
+    sizes for as long as it lives, so later pulls reuse warm connections and what was learned
+    about the upstream. URLs are always built on the primary XIVAPI URL; each request is sent
+    to whichever equivalent endpoint is currently fastest and healthy, and pages are cached by
+    path and query alone, so they are shared between endpoints.
+    """
+    def __init__(
+        self,
+        xivapi_url,
+        mirror_urls=(),
+        page_cache=None,
+        cassette=None,
+        session=None,
+        rate_limiter=None,
+        concurrency=None,
+        csv_dir=None,
+        max_attempts=MAX_ATTEMPTS
+    ):
+        self.xivapi_url = xivapi_url
+        self.endpoints = EndpointPool([xivapi_url, *mirror_urls])
+        self.hedge_executor = ThreadPoolExecutor(
+            max_workers=HEDGE_WORKERS,
+            thread_name_prefix='hedge'
+        ) if mirror_urls else None
+        self.page_cache = page_cache
+        self.cassette = cassette
+        self.session = session or XivapiSession(hosts=len(self.endpoints))
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.concurrency = concurrency or AimdWindow()
+        self.csv_dir = csv_dir
+        self.max_attempts = max_attempts
+        self.page_sizes = {}
+        self.page_sizes_lock = threading.Lock()
+        self.circuit_breakers = {}
+        self.circuit_breakers_lock = threading.Lock()
+        self.start(RunMetrics())
+
+    def start(self, metrics):
+        """
+        Starts fetching for a new pull, recording into its metrics.
+        """
+        self.metrics = metrics
+        self.game_version = None
+        self.schema = None
+        self.usable_page_cache = None
+        self.csv_sheets = CsvSheets(self.csv_dir) if self.csv_dir is not None else None
+
+    def use_game_version(self, game_version, probe_sheet, probe_fields):
+        """
+        Fetches sheets of a game version, probing the schema they are served with from a single
+        row of a sheet and keeping the page cache to pages of both.
+        """
+        self.game_version = game_version
+        if self.csv_sheets is not None or game_version == LATEST_VERSION \
+                or self.cassette is not None and self.cassette.replaying:
+            return
+        probe_url = f'{self.construct_url(probe_sheet, probe_fields)}&limit=1'
+        self.record_schema(self.fetch_json(probe_url))
+        if self.page_cache is not None:
+            self.page_cache.use_namespace(f'{game_version}\n{self.schema}')
+            self.usable_page_cache = self.page_cache
+
+    def record_schema(self, page):
+        """
+        Records the XIVAPI schema that a page was served with.
+        """
+        if page.get('schema') is not None:
+            self.schema = page['schema']
+
+    def get_game_version(self):
+        """
+        Retrieves the latest game version known to XIVAPI, or the version of the CSV exports
+        when reading from them.
+        """
+        if self.csv_sheets is not None:
+            return self.csv_sheets.game_version()
+        url = f'{self.xivapi_url}/api/1/version'
+        if self.cassette is not None and self.cassette.replaying:
+            versions = self.cassette.get(url, 0)['versions']
+        else:
+            response = self.fetch_json(url)
+            if self.cassette is not None:
+                self.cassette.put(url, 0, response)
+            versions = response['versions']
+        for version in versions:
+            if LATEST_VERSION in version['names']:
+                return next(
+                    (name for name in version['names'] if name != LATEST_VERSION),
+                    LATEST_VERSION
+                )
+        return versions[-1]['names'][0]
+
+    def construct_url(self, sheet_name, fields):
+        """
+        Constructs a URL for XIVAPI with fields.
+        """
+        url = f'{self.xivapi_url}/api/1/sheet/{sheet_name}?fields={",".join(fields)}'
+        if self.game_version is not None:
+            url += f'&version={self.game_version}'
+        return url
+
+    def iter_sheet(self, sheet_name, fields, prefetch_pages=0):
+        """
+        Iterates over the rows of a sheet with fields, streamed from XIVAPI as pages arrive or
+        read whole from its CSV export. Sharded sheets retrieve at most prefetch_pages pages
+        ahead of the rows being consumed, or without limit if it is 0.
+        """
+        if self.csv_sheets is not None:
+            return self.read_csv_sheet(sheet_name, fields)
+        return self.iter_paginated_data(
+            self.construct_url(sheet_name, fields),
+            SHARD_WORKERS.get(sheet_name, 1),
+            prefetch_pages
+        )
+
+    def get_rows(self, sheet_name, fields, row_ids):
+        """
+        Retrieves the rows of a sheet with the given row_ids, selected from XIVAPI in concurrent
+        batches or read from its CSV export.
+        """
+        if self.csv_sheets is not None:
+            return self.read_csv_sheet(sheet_name, fields, row_ids)
+        base_url = self.construct_url(sheet_name, fields)
+        batches = [
+            row_ids[start:start + ROW_BATCH_SIZE]
+            for start in range(0, len(row_ids), ROW_BATCH_SIZE)
+        ]
+        with ThreadPoolExecutor(max_workers=ROW_WORKERS) as executor:
+            pages = executor.map(
+                lambda batch: self.get_data_for_page(
+                    f'{base_url}&rows={",".join(str(row_id) for row_id in batch)}',
+                    0,
+                    limit=len(batch)
+                ),
+                batches
+            )
+            rows = [row for page in pages for row in page]
+        self.metrics.record_rows(sheet_name, len(rows))
+        return rows
+
+    def read_csv_sheet(self, sheet_name, fields, row_ids=None):
+        """
+        Reads rows of a sheet from its CSV export, shaped as XIVAPI would return them for the
+        fields, recording the read as a single page.
+        """
+        started = time.perf_counter()
+        rows = self.csv_sheets.rows(sheet_name, fields, row_ids)
+        self.metrics.record_page(sheet_name, 'csv', time.perf_counter() - started)
+        self.metrics.record_rows(sheet_name, len(rows))
+        return rows
+
+    def get_data_for_page(self, base_url, i, limit=None):
+        """
+        Retrieves data from XIVAPI starting from a specific result, recording how long it took
+        and where the page came from.
+        """
+        started = time.perf_counter()
+        page, source = self.retrieve_page(base_url, i, limit)
+        self.metrics.record_page(get_sheet_name(base_url), source, time.perf_counter() - started)
+        self.record_schema(page)
+        return page['rows']
+
+    def retrieve_page(self, base_url, i, limit=None):
+        """
+        Retrieves a page from the cassette, the page cache or XIVAPI, returning it and where it
+        came from.
+        """
+        page_cache = self.usable_page_cache
+        cassette = self.cassette
+        page_size = None
+        if limit is None:
+            with self.page_sizes_lock:
+                if base_url not in self.page_sizes:
+                    self.page_sizes[base_url] = AdaptivePageSize(get_sheet_name(base_url))
+                page_size = self.page_sizes[base_url]
+        else:
+            base_url = f'{base_url}&limit={limit}'
+        if cassette is not None and cassette.replaying:
+            return cassette.get(base_url, i), 'cassette'
+        if page_cache is not None:
+            page = page_cache.get(base_url, i)
+            if page is not None:
+                if cassette is not None:
+                    cassette.put(base_url, i, page)
+                return page, 'cache'
+        page = self.fetch_json(base_url if i == 0 else f'{base_url}&after={i}', page_size)
+        if page_cache is not None:
+            page_cache.put(base_url, i, page)
+        if cassette is not None:
+            cassette.put(base_url, i, page)
+        return page, 'network'
+
+    def fetch_json(self, url, page_size=None):
+        """
+        Retrieves JSON from XIVAPI, retrying with backoff until it runs out of attempts.
+        """
+        path = url[len(self.xivapi_url):]
+        failed_endpoints = []
+        for attempt in range(self.max_attempts):
+            sized_url = url
+            if page_size is not None:
+                size = page_size.size
+                sized_url = f'{url}&limit={size}'
+            endpoint = None
+            try:
+                req = self.send_request(sized_url, avoid=failed_endpoints)
+                endpoint = self.endpoints.find(req.url)
+                if req.status_code in (400, 413) and page_size is not None \
+                        and size > page_size.minimum:
+                    page_size.shrink(size, f'HTTP {req.status_code}', too_large=True)
+                    self.session.record_retry()
+                    continue
+                if req.status_code == 200:
+                    decode_started = time.perf_counter()
+                    data = req.json()
+                    self.metrics.record_decode(time.perf_counter() - decode_started)
+                    if page_size is not None:
+                        page_size.record_page(size, len(req.content))
+                    return data
+                delay = backoff_delay(attempt)
+                if req.status_code == 429:
+                    delay = max(delay, parse_retry_after(req.headers.get('Retry-After')) or 0)
+                reason = f'HTTP {req.status_code}'
+            except requests.exceptions.Timeout as error:
+                if page_size is not None:
+                    page_size.shrink(size, 'timeout')
+                delay = backoff_delay(attempt)
+                endpoint = self.endpoints.find(request_url(error))
+                reason = 'timeout'
+            except (requests.exceptions.RequestException, ValueError) as error:
+                delay = backoff_delay(attempt)
+                endpoint = endpoint or self.endpoints.find(request_url(error))
+                reason = type(error).__name__
+            if endpoint is not None:
+                failed_endpoints.append(endpoint)
+                reason = f'{reason} from {endpoint.url}'
+            print(f'Retrying for {path} in {delay:.1f}s ({reason})')
+            self.session.record_retry()
+            time.sleep(delay)
+        raise PageUnavailable(f'Out of retries for {path} ({reason})')
+
+    def get_circuit_breaker(self, url):
+        """
+        Retrieves the circuit breaker for a URL's host, starting a new one if needed.
+        """
+        host = urlsplit(url).netloc
+        with self.circuit_breakers_lock:
+            if host not in self.circuit_breakers:
+                self.circuit_breakers[host] = CircuitBreaker(host)
+            return self.circuit_breakers[host]
+
+    def choose_endpoint(self, exclude=()):
+        """
+        Chooses the endpoint to send a request to, passing over those whose host's circuit
+        breaker is open.
+        """
+        return self.endpoints.choose(
+            exclude,
+            lambda endpoint: self.get_circuit_breaker(endpoint.url).is_open()
+        )
+
+    def send_request(self, url, avoid=()):
+        """
+        Sends a request to the best endpoint not to avoid, hedging it to the next best one when
+        it is slow.
+        """
+        path = url[len(self.xivapi_url):]
+        endpoint = self.choose_endpoint(exclude=avoid) or self.choose_endpoint()
+        hedge_delay = self.endpoints.hedge_delay(endpoint)
+        if hedge_delay is None:
+            return self.send_to_endpoint(endpoint, path)
+        sent = threading.Event()
+        first = self.hedge_executor.submit(self.send_to_endpoint, endpoint, path, sent)
+        while not sent.wait(0.1):
+            if first.done():
+                return first.result()
+        if wait([first], timeout=hedge_delay).done:
+            return first.result()
+        hedge_endpoint = self.choose_endpoint(exclude=(endpoint,))
+        second = self.hedge_executor.submit(self.send_to_endpoint, hedge_endpoint, path)
+        for future in as_completed([first, second]):
+            if future.exception() is None and future.result().status_code == 200:
+                self.metrics.record_hedge(won=future is second)
+                return future.result()
+        self.metrics.record_hedge(won=False)
+        return first.result()
+
+    def send_to_endpoint(self, endpoint, path, sent=None):
+        """
+        Sends a request to an endpoint once its throttles allow it, setting the sent event if
+        there is one, and feeds the outcome back to them.
+        """
+        url = f'{endpoint.url}{path}'
+        circuit_breaker = self.get_circuit_breaker(url)
+        circuit_breaker.wait_until_allowed()
+        self.rate_limiter.acquire()
+        self.concurrency.acquire()
+        if sent is not None:
+            sent.set()
+        started = time.monotonic()
+        try:
+            req = self.session.get(url, timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException:
+            self.metrics.record_request(time.monotonic() - started, None, endpoint.url)
+            self.concurrency.release(time.monotonic() - started, congested=True)
+            endpoint.record(time.monotonic() - started, failed=True)
+            circuit_breaker.record_failure()
+            raise
+        latency = time.monotonic() - started
+        self.metrics.record_request(latency, req.status_code, endpoint.url)
+        self.concurrency.release(
+            latency,
+            congested=req.status_code == 429,
+            kind=request_kind(path)
+        )
+        endpoint.record(latency, failed=req.status_code == 429 or req.status_code >= 500)
+        if req.status_code >= 500:
+            circuit_breaker.record_failure()
+        else:
+            circuit_breaker.record_success()
+        return req
+
+    def iter_paginated_data(self, base_url, workers=1, prefetch_pages=0):
+        """
+        Yields paginated data from XIVAPI row by row as pages arrive, in row_id shards retrieved
+        in parallel when there is more than one worker.
+        """
+        if workers > 1:
+            pages = self.iter_sharded_pages(base_url, workers, prefetch_pages)
+        else:
+            pages = self.iter_row_range_pages(base_url, 0, None)
+        for page in pages:
+            yield from page
+
+    def iter_row_range_pages(self, base_url, start, end):
+        """
+        Yields pages of rows with a row_id after start and up to end, walking pages from start.
+        A start of 0 includes row 0, and an end of None retrieves everything to the end of the
+        sheet. The last good cursor is checkpointed after every page.
+        """
+        page_cache = self.usable_page_cache
+        checkpoint_key = f'{base_url}#{start}'
+        if page_cache is not None:
+            checkpoint = page_cache.get_checkpoint(checkpoint_key)
+            if checkpoint is not None and not checkpoint['complete']:
+                print(f'Resuming {base_url} from row {start}, '
+                      f'cached up to row {checkpoint["cursor"]}')
+        sheet_name = get_sheet_name(base_url)
+        i = start
+        sub_data = self.get_data_for_page(base_url, i)
+        while len(sub_data) > 0:
+            if end is not None and sub_data[-1]['row_id'] >= end:
+                sub_data = [row for row in sub_data if row['row_id'] <= end]
+                self.metrics.record_rows(sheet_name, len(sub_data))
+                yield sub_data
+                break
+            self.metrics.record_rows(sheet_name, len(sub_data))
+            yield sub_data
+            i = sub_data[-1]['row_id']
+            if page_cache is not None:
+                page_cache.set_checkpoint(checkpoint_key, i)
+            sub_data = self.get_data_for_page(base_url, i)
+        if page_cache is not None:
+            page_cache.set_checkpoint(checkpoint_key, i, complete=True)
+
+    def find_row_id_span(self, base_url, workers):
+        """
+        Finds a row_id that no rows in the sheet are after, probing single rows with an
+        exponential search followed by a binary search. The search stops once it is precise
+        enough to balance the shards for the given number of workers.
+        """
+        low = 0
+        high = SHARD_PROBE_START
+        probe = self.get_data_for_page(base_url, high, limit=1)
+        while len(probe) > 0:
+            low = probe[0]['row_id']
+            high = low * 2
+            probe = self.get_data_for_page(base_url, high, limit=1)
+        while high - low > high // (workers * 4):
+            middle = (low + high) // 2
+            probe = self.get_data_for_page(base_url, middle, limit=1)
+            if len(probe) > 0:
+                low = probe[0]['row_id']
+            else:
+                high = middle
+        return high
+
+    def iter_sharded_pages(self, base_url, workers, prefetch_pages):
+        """
+        Retrieves a sheet as parallel row_id shards, yielding their pages in row order. Each
+        shard hands its pages over through its own queue, bounded by prefetch_pages.
+        """
+        span = self.find_row_id_span(base_url, workers)
+        bounds = sorted({span * shard // workers for shard in range(workers + 1)})
+        shard_queues = [queue.Queue(maxsize=prefetch_pages) for _ in bounds[1:]]
+        stopped = threading.Event()
+
+        def fetch_shard(shard_queue, start, end):
+            try:
+                for page in self.iter_row_range_pages(base_url, start, end):
+                    if not put_unless_stopped(shard_queue, page, stopped):
+                        return
+                put_unless_stopped(shard_queue, None, stopped)
+            except Exception as error: # pylint: disable=broad-exception-caught
+                put_unless_stopped(shard_queue, error, stopped)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for shard_queue, start, end in zip(shard_queues, bounds, bounds[1:]):
+                executor.submit(fetch_shard, shard_queue, start, end)
+            try:
+                for shard_queue in shard_queues:
+                    page = shard_queue.get()
+                    while page is not None:
+                        if isinstance(page, Exception):
+                            raise page
+                        yield page
+                        page = shard_queue.get()
+            finally:
+                stopped.set()
+
+    def print_summary(self, report):
+        """
+        Prints the page sizes, page cache hits, HTTP traffic and endpoint latencies of the
+        fetcher, with those of the last pull from its run report.
+        """
+        print('Page sizes: ' + ', '.join(
+            f'{page_size.name} {page_size.size}' for page_size in self.page_sizes.values()
+        ))
+        if self.page_cache is not None:
+            print(f'Page cache: {self.page_cache.hits} hits, {self.page_cache.misses} misses')
+        stats = self.session.stats()
+        print(
+            f'HTTP: {stats["requests"]} requests ({stats["retries"]} retried) '
+            f'over {stats["connections_opened"]} connections, '
+            f'{stats["wire_bytes"]} bytes on the wire, {stats["decoded_bytes"]} bytes decoded'
+        )
+        latency = report['requests']['latency_ms']
+        if latency:
+            print('Request latency: ' + ', '.join(f'{name} {ms}ms' for name, ms in latency.items()))
+        if len(self.endpoints) > 1:
+            for endpoint, counts in report['endpoints'].items():
+                print(f'Endpoint {endpoint}: {counts["requests"]} requests, {counts["errors"]} '
+                      f'errors, p50 {counts["latency_ms"].get("p50")}ms')
+            hedges = report['hedges']
+            print(f'Hedged requests: {hedges["sent"]} sent, {hedges["won"]} answered first by '
+                  f'the hedge')
+
+def request_kind(url):
+    """
+    Tells requests apart by what they ask for: the sheet, its fields and the page size in
+    their limit, but not where the page starts, so that their latencies are only compared with
+    those of requests like them.
+    """
+    parts = urlsplit(url)
+    query = parse_qs(parts.query)
+    return parts.path, query.get('fields', [None])[-1], query.get('limit', [None])[-1]
+
+def request_url(error):
+    """
+    Finds the URL that a failed request was sent to, when the error tells.
+    """
+    request = getattr(error, 'request', None)
+    return request.url if request is not None else None
+
+def get_sheet_name(url):
+    """
+    Retrieves the sheet name from an XIVAPI sheet URL.
+    """
+    return url.split('/sheet/', 1)[1].split('?', 1)[0]
+
+def put_unless_stopped(target_queue, item, stopped):
+    """
+    Puts an item on a bounded queue, giving up if the consumer has stopped reading.
+    """
+    while not stopped.is_set():
+        try:
+            target_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
@@ -0,0 +1,53 @@
+"""
+Adaptive page sizes for XIVAPI pagination.
+"""
+import threading
+
+MAX_PAGE_SIZE = 500
+MIN_PAGE_SIZE = 10
+MAX_PAGE_BYTES = 4 * 1024 * 1024
+GROW_AFTER_PAGES = 20
+
+class AdaptivePageSize:
+    """
+    Tracks the page size to request from one sheet. It starts at the largest size the API
+    accepts and halves whenever a page times out or is rejected or too large. Rejected and
+    oversized pages also lower the largest size that will be tried again; after a run of healthy
+    pages the size doubles back up to it.
+    """
+    def __init__(self, name, maximum=MAX_PAGE_SIZE, minimum=MIN_PAGE_SIZE):
+        self.name = name
+        self.maximum = maximum
+        self.minimum = minimum
+        self.size = maximum
+        self.healthy_pages = 0
+        self.lock = threading.Lock()
+
+    def shrink(self, failed_size, reason, too_large=False):
+        """
+        Halves the size of a failed page. Pages requested concurrently at the same size only
+        shrink it once.
+        """
+        with self.lock:
+            self.healthy_pages = 0
+            size = max(self.minimum, min(self.size, failed_size // 2))
+            if too_large:
+                self.maximum = min(self.maximum, max(self.minimum, failed_size - 1))
+            if size < self.size:
+                self.size = size
+                print(f'Page size for {self.name} reduced to {self.size} ({reason})')
+
+    def record_page(self, size, byte_count):
+        """
+        Records a page retrieved at the given size, shrinking if it was oversized and growing
+        after enough healthy pages in a row.
+        """
+        if byte_count > MAX_PAGE_BYTES:
+            self.shrink(size, f'{byte_count} byte page', too_large=True)
+            return
+        with self.lock:
+            self.healthy_pages += 1
+            if self.healthy_pages >= GROW_AFTER_PAGES and self.size < self.maximum:
+                self.healthy_pages = 0
+                self.size = min(self.maximum, self.size * 2)
+                print(f'Page size for {self.name} increased to {self.size}')
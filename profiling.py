@@ -0,0 +1,153 @@
+"""
+Profiling of a whole pull: time per function, sampled call stacks and allocation sites per stage.
+"""
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+
+SAMPLE_INTERVAL = 0.01
+TOP_ALLOCATIONS = 10
+PSTATS_FILE = 'pull.pstats'
+COLLAPSED_FILE = 'pull.collapsed'
+ALLOCATIONS_FILE = 'allocations.txt'
+
+class Profiler:
+    """
+    Profiles everything that runs between start and stop, in every thread, and writes the
+    results to a directory:
+
+    - pull.pstats, cProfile statistics for use with pstats or snakeviz. Before Python 3.12
+      cProfile follows a single thread, so each thread started meanwhile gets a profile of its
+      own and they are merged; from 3.12 one profile sees every thread.
+    - pull.collapsed, the call stacks of every thread sampled at an interval, one line per
+      stack with its sample count, as flamegraph.pl and speedscope take them.
+    - allocations.txt, the lines that allocated the most memory during each stage, from
+      tracemalloc snapshots taken around it. Stages that run concurrently share the process's
+      memory, so their allocation sites may include each other's.
+    """
+    def __init__(self, directory, sample_interval=SAMPLE_INTERVAL):
+        self.directory = directory
+        self.sample_interval = sample_interval
+        self.lock = threading.Lock()
+        self.profiles = []
+        self.stacks = {}
+        self.snapshots = {}
+        self.peak_traced = 0
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, name='profiler', daemon=True)
+
+    def start(self):
+        """
+        Starts profiling.
+        """
+        tracemalloc.start()
+        self.sampler.start()
+        if sys.version_info < (3, 12):
+            threading.setprofile(self.profile_thread)
+        self.profile_thread()
+
+    def profile_thread(self, *args): # pylint: disable=unused-argument
+        """
+        Starts a profile of the calling thread. Installed as the profile hook of new threads,
+        it is called on a thread's first call and replaced by the profile it starts.
+        """
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def sample(self):
+        """
+        Records the call stack of every other thread each interval until stopped.
+        """
+        sampler = threading.get_ident()
+        while not self.stopped.wait(self.sample_interval):
+            for thread, frame in sys._current_frames().items(): # pylint: disable=protected-access
+                if thread == sampler:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f'{code.co_name} ({os.path.basename(code.co_filename)}:'
+                        f'{code.co_firstlineno})'
+                    )
+                    frame = frame.f_back
+                collapsed = ';'.join(reversed(stack))
+                self.stacks[collapsed] = self.stacks.get(collapsed, 0) + 1
+
+    def stage(self, name, function):
+        """
+        Wraps a stage's function so that the memory it allocates is traced to its sources. The
+        snapshots are only compared once profiling stops, to keep the comparison out of the
+        profile.
+        """
+        def run(*args):
+            before = tracemalloc.take_snapshot()
+            try:
+                return function(*args)
+            finally:
+                after = tracemalloc.take_snapshot()
+                with self.lock:
+                    self.snapshots[name] = (before, after)
+        return run
+
+    def stop(self):
+        """
+        Stops profiling and writes the results.
+        """
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+        self.profiles[0].disable()
+        self.stopped.set()
+        self.sampler.join()
+        self.peak_traced = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        os.makedirs(self.directory, exist_ok=True)
+        self.write_pstats()
+        self.write_collapsed()
+        self.write_allocations()
+
+    def write_pstats(self):
+        """
+        Merges the profiles of every thread into one pstats file.
+        """
+        profiles = []
+        for profile in self.profiles:
+            profile.create_stats()
+            if profile.stats:
+                profiles.append(profile)
+        pstats.Stats(*profiles).dump_stats(os.path.join(self.directory, PSTATS_FILE))
+
+    def write_collapsed(self):
+        """
+        Writes the sampled call stacks in collapsed form.
+        """
+        with open(os.path.join(self.directory, COLLAPSED_FILE), 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f'{stack} {count}\n')
+
+    def write_allocations(self):
+        """
+        Writes the top allocation sites of each stage.
+        """
+        with open(os.path.join(self.directory, ALLOCATIONS_FILE), 'w', encoding='utf-8') as f:
+            f.write(f'Peak traced memory: {self.peak_traced} bytes\n')
+            own_traces = [
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, tracemalloc.__file__)
+            ]
+            for name, (before, after) in self.snapshots.items():
+                f.write(f'\n{name}:\n')
+                differences = after.filter_traces(own_traces).compare_to(
+                    before.filter_traces(own_traces),
+                    'lineno'
+                )
+                allocations = [
+                    difference for difference in differences if difference.size_diff > 0
+                ]
+                for allocation in allocations[:TOP_ALLOCATIONS]:
+                    f.write(f'  {allocation}\n')
@@ -1,203 +1,983 @@
 """
 Pulls data on craftable and gatherable items, and stores it in JSON files.
 """
+import argparse
 import json
 import os
-import requests
+import random
+import signal
+import sys
+import threading
+import time
+from cassette import Cassette
+from compression import FORMATS, LIBRARIES, is_available, write_compressed
+from dataset import Dataset
+from item_names import LANGUAGES, encode_names, name_field, read_names
+from json_stream import open_writer
+from page_cache import PageCache
+from page_fetcher import LATEST_VERSION, MAX_ATTEMPTS, PageFetcher
+from profiling import ALLOCATIONS_FILE, COLLAPSED_FILE, PSTATS_FILE, Profiler
+from recipe_trees import (
+    build_recipes,
+    build_used_in,
+    choose_recipe,
+    read_recipes,
+    recipe_item_ids
+)
+from run_report import ProgressLine, RunMetrics
+from sheet_join import gathering_item_join, join_gathering_points
+from snapshots import (
+    carry_over,
+    create_snapshot,
+    current_snapshot,
+    discard_snapshot,
+    is_redundant,
+    publish_snapshot,
+    read_manifest,
+    write_manifest
+)
+from sqlite_store import CATEGORIES, DATABASE, write_snapshot_database
+from stage_runner import run_stages
 
-mining_types = [0,1]
-botany_types = [2,3]
-gathering_items_for_lookup = {}
-items = []
-mining_items = []
-botany_items = []
-fishing_items = []
-crafting_items = {}
+STREAM_PREFETCH_PAGES = 4
+XIVAPI_URL = 'https://beta.xivapi.com'
+DATA_DIR = 'data'
+CACHE_DIR = 'cache'
+SERVER_PID_FILE = os.path.join(DATA_DIR, 'server.pid')
+DAEMON_EVERY_HOURS = 6
+DAEMON_JITTER_MINUTES = 30
+SCHEMA_PROBE_SHEET = 'GatheringItemLevelConvertTable'
+GATHERING_SHEETS = ('GatheringPointBase', 'GatheringItem', 'GatheringItemLevelConvertTable')
+SHEET_FIELDS = {
+    'GatheringPointBase': [
+        'Item[].value',
+        'GatheringType.value',
+        'Item[].GatheringItemLevel.value'
+    ],
+    'GatheringItem': ['Item.value'],
+    'GatheringItemLevelConvertTable': ['GatheringItemLevel'],
+    'FishingSpot': ['Item[].value', 'GatheringLevel'],
+    'Recipe': [
+        'CraftType.Name',
+        'ItemResult.Value',
+        'AmountResult',
+        'RecipeLevelTable.ClassJobLevel',
+        'Ingredient[].value',
+        'AmountIngredient[]'
+    ],
+    'Item': [name_field(language) for language in LANGUAGES]
+}
+JOINED_GATHERING_FIELDS = [
+    'GatheringType.value',
+    'Item[].value',
+    'Item[].Item.value',
+    'Item[].GatheringItemLevel.GatheringItemLevel'
+]
+OUTPUT_SHEETS = {
+    'mining': GATHERING_SHEETS,
+    'botany': GATHERING_SHEETS,
+    'fishing': ('FishingSpot',),
+    'crafting': ('Recipe',),
+    'recipes': ('Recipe',),
+    'used_in': ('Recipe',)
+}
+NAME_SHEETS = ('Item',) + tuple(sheet for sheet in SHEET_FIELDS if sheet != 'Item')
+MINING_TYPES = [0,1]
+BOTANY_TYPES = [2,3]
+RECORD_ORDER = ['level', 'id']
+PULL_STAGES = {
+    'fetch gathering points': ('fetch_sheet', ('GatheringPointBase',), ()),
+    'fetch gathering items': ('fetch_sheet', ('GatheringItem',), ()),
+    'fetch gathering item levels': ('fetch_sheet', ('GatheringItemLevelConvertTable',), ()),
+    'gathering items': (
+        'get_gathering_items',
+        (),
+        ('fetch gathering points', 'fetch gathering items', 'fetch gathering item levels')
+    ),
+    'mining and botany items': ('sort_mining_and_botany_items', (), ('gathering items',)),
+    'fishing spots': ('get_fishing_spots', (), ()),
+    'recipes': ('get_recipes', (), ()),
+}
+STREAM_STAGES = {
+    'fetch gathering points': PULL_STAGES['fetch gathering points'],
+    'fetch gathering item levels': PULL_STAGES['fetch gathering item levels'],
+    'gathering items': (
+        'stream_gathering_items',
+        (),
+        ('fetch gathering points', 'fetch gathering item levels')
+    ),
+    'fishing spots': PULL_STAGES['fishing spots'],
+    'recipes': PULL_STAGES['recipes'],
+}
+JOINED_GATHERING_STAGES = {
+    'gathering items': ('get_joined_gathering_items', (), ()),
+}
+STAGE_SHEETS = {
+    'fetch gathering points': GATHERING_SHEETS,
+    'fetch gathering items': GATHERING_SHEETS,
+    'fetch gathering item levels': GATHERING_SHEETS,
+    'gathering items': GATHERING_SHEETS,
+    'mining and botany items': GATHERING_SHEETS,
+    'fishing spots': ('FishingSpot',),
+    'recipes': ('Recipe',)
+}
 
-def get_data_for_page(base_url, i):
+class Puller: # pylint: disable=too-many-public-methods
     """
-    Retrieves data from XIVAPI starting from a specific result.
+    Pulls crafting and gathering data from XIVAPI into immutable datasets.
+
+    A puller retrieves pages through its page fetcher, which lives as long as the puller, so
+    pulling again reuses warm connections and what was learned about the upstream. Everything a
+    single pull builds is kept apart and started afresh by each pull, so the same puller can
+    pull any number of times in one process. Pulls on the same puller run one at a time;
+    separate pullers can pull concurrently as long as their data directories differ.
     """
-    retries = 10
-    while retries > 0:
-        try:
-            if i == 0:
-                req = requests.get(base_url, timeout=30)
-            else:
-                req = requests.get(f'{base_url}&after={i}', timeout=30)
-            if req.status_code != 200:
-                print(f'Retrying for {base_url} for results from {i}')
-                retries -= 1
+    def __init__(
+        self,
+        xivapi_url=XIVAPI_URL,
+        mirror_urls=(),
+        data_dir=DATA_DIR,
+        page_cache=None,
+        cassette=None,
+        session=None,
+        rate_limiter=None,
+        concurrency=None,
+        compressions=(),
+        sqlite=False,
+        progress=False,
+        profiler=None,
+        csv_dir=None,
+        max_attempts=MAX_ATTEMPTS
+    ):
+        self.fetcher = PageFetcher(
+            xivapi_url,
+            mirror_urls,
+            page_cache,
+            cassette,
+            session,
+            rate_limiter,
+            concurrency,
+            csv_dir,
+            max_attempts
+        )
+        self.data_dir = data_dir
+        self.compressions = tuple(compressions)
+        self.sqlite = sqlite
+        self.progress = progress
+        self.profiler = profiler
+        self.pull_lock = threading.Lock()
+        self.start_pull()
+
+    def start_pull(self):
+        """
+        Forgets everything the last pull built.
+        """
+        self.sheets = {}
+        self.items = []
+        self.outputs = {
+            'mining': [],
+            'botany': [],
+            'fishing': [],
+            'crafting': {},
+            'recipes': {},
+            'used_in': {}
+        }
+        self.records = {}
+        self.recipes = {}
+        self.uses = {}
+        self.writers = {}
+        self.previous_snapshot = None
+        self.reused_counts = {}
+        self.snapshot = None
+        self.metrics = RunMetrics()
+        self.fetcher.start(self.metrics)
+
+    def previous_path(self, file_name):
+        """
+        Finds the path of a data file in the snapshot that was current when the pull started.
+        """
+        return os.path.join(self.previous_snapshot, f'{file_name}.json')
+
+    def snapshot_path(self, file_name):
+        """
+        Finds the path of a data file in the snapshot being built.
+        """
+        return os.path.join(self.snapshot, f'{file_name}.json')
+
+    def fetch_sheet(self, sheet_name):
+        """
+        Retrieves a whole sheet and keeps it for the stages that join against it.
+        """
+        print(f'Retrieving {sheet_name} sheet...')
+        self.sheets[sheet_name] = list(
+            self.fetcher.iter_sheet(sheet_name, SHEET_FIELDS[sheet_name])
+        )
+
+    def iter_sheet(self, sheet_name, fields=None):
+        """
+        Iterates over the rows of a sheet, either already retrieved by fetch_sheet or streamed
+        as pages arrive. When streaming output, sharded sheets only prefetch a few pages. Fields
+        other than the sheet's usual ones are always streamed.
+        """
+        if fields is None and sheet_name in self.sheets:
+            return self.sheets[sheet_name]
+        return self.fetcher.iter_sheet(
+            sheet_name,
+            fields or SHEET_FIELDS[sheet_name],
+            STREAM_PREFETCH_PAGES if self.writers else 0
+        )
+
+    def emit(self, output, record, group=None):
+        """
+        Adds a record to an output. An item appears once per output, or once per group for
+        records with a group, at the lowest level it was emitted with. Only the level kept for
+        each item is held until the records are finished.
+        """
+        levels = self.records.setdefault(output, {}).setdefault(group, {})
+        kept = levels.get(record['id'])
+        if kept is None or record['level'] < kept:
+            levels[record['id']] = record['level']
+
+    def finish_records(self):
+        """
+        Hands each output its deduplicated records sorted by level and then id, grouped when
+        they have a group, writing them to its file when streaming.
+        """
+        for output, groups in self.records.items():
+            for group in sorted(groups, key=lambda group: (group is not None, group)):
+                for record in sort_records(
+                    {'id': item_id, 'level': level} for item_id, level in groups[group].items()
+                ):
+                    if output not in self.writers:
+                        if group is None:
+                            self.outputs[output].append(record)
+                        else:
+                            self.outputs[output].setdefault(group, []).append(record)
+                    elif group is None:
+                        self.writers[output].write(record)
+                    else:
+                        self.writers[output].write(group, record)
+        self.records.clear()
+
+    def gathering_item_join(self):
+        """
+        Declares the join of gathering items to their gathering points and raw levels.
+        """
+        return gathering_item_join(
+            self.iter_sheet('GatheringPointBase'),
+            self.iter_sheet('GatheringItemLevelConvertTable')
+        )
+
+    def get_gathering_items(self):
+        """
+        Joins gathering items to their gathering points and raw levels.
+        """
+        print('Joining gathering items...')
+        self.items.extend(self.gathering_item_join().run(self.iter_sheet('GatheringItem')))
+
+    def sort_mining_and_botany_items(self):
+        """
+        Sorts mining and botany items.
+        """
+        print('Sorting mining and botany items...')
+        for item in self.items:
+            self.sort_gathering_item(item)
+
+    def sort_gathering_item(self, item):
+        """
+        Sorts a gathering item into mining or botany items.
+        """
+        if item['type'] in MINING_TYPES:
+            self.emit('mining', {'id': item['id'], 'level': item['level']})
+        elif item['type'] in BOTANY_TYPES:
+            self.emit('botany', {'id': item['id'], 'level': item['level']})
+
+    def stream_gathering_items(self):
+        """
+        Streams gathering items, joining and sorting each one as it arrives.
+        """
+        print('Streaming gathering items...')
+        for item in self.gathering_item_join().run(self.iter_sheet('GatheringItem')):
+            self.sort_gathering_item(item)
+
+    def get_joined_gathering_items(self):
+        """
+        Retrieves gathering items in a single crawl of gathering points, with their items,
+        levels and gathering types joined by XIVAPI, and sorts them into mining and botany
+        items.
+        """
+        print('Retrieving joined gathering items...')
+        gathering_points = self.iter_sheet('GatheringPointBase', JOINED_GATHERING_FIELDS)
+        for item in join_gathering_points(gathering_points):
+            self.sort_gathering_item(item)
+
+    def verify_joined_gathering(self):
+        """
+        Checks that the single-pass join of gathering points gives the same gathering items as
+        the three-pass join that the last pull ran.
+        """
+        print('Verifying joined gathering items...')
+        items = self.items
+        joined_items = join_gathering_points(
+            self.iter_sheet('GatheringPointBase', JOINED_GATHERING_FIELDS)
+        )
+        if joined_items == items:
+            print(f'Joined gathering items match the three-pass join ({len(items)} items).')
+            return True
+        differences = sum(1 for joined, item in zip(joined_items, items) if joined != item)
+        differences += abs(len(joined_items) - len(items))
+        print(f'Joined gathering items differ from the three-pass join: {differences} '
+              f'differences between {len(joined_items)} joined and {len(items)} three-pass '
+              f'items.')
+        return False
+
+    def get_fishing_spots(self):
+        """
+        Retrieves fishing spots from XIVAPI.
+        """
+        print('Retrieving fishing spots...')
+        for fishing_spot in self.iter_sheet('FishingSpot'):
+            for item in fishing_spot['fields']['Item']:
+                if item['value'] == 0:
+                    continue
+                self.emit(
+                    'fishing',
+                    {
+                        'id': item['value'],
+                        'level': fishing_spot['fields']['GatheringLevel']
+                    }
+                )
+
+    def get_recipes(self):
+        """
+        Retrieves recipes from XIVAPI, along with their ingredients and the amounts they take.
+        Every recipe counts towards the recipes its ingredients are used in, not only the one
+        kept for its result item.
+        """
+        print('Retrieving recipes...')
+        for recipe in self.iter_sheet('Recipe'):
+            if recipe['fields']['ItemResult']['value'] == 0:
                 continue
-            return req.json()['rows']
-        except ConnectionError:
-            print(f'Retrying for {base_url} for results from {i}')
-            retries -= 1
-    print(f'OUT OF RETRIES FOR {base_url} for results from {i}')
-    return []
-
-def get_paginated_data(base_url):
-    """
-    Retrieves paginated data from XIVAPI.
-    """
-    i = 0
-    data = []
-    sub_data = get_data_for_page(base_url, i)
-    while len(sub_data) > 0:
-        data.extend(sub_data)
-        i = sub_data[-1]['row_id']
-        sub_data = get_data_for_page(base_url, i)
-    return data
-
-def construct_xivapi_url(sheet_name, fields):
-    """
-    Constructs a URL for XIVAPI with fields.
-    """
-    return f'https://beta.xivapi.com/api/1/sheet/{sheet_name}?fields={",".join(fields)}'
-
-def get_gathering_points():
-    """
-    Retrieves gathering points from XIVAPI.
-    """
-    print('Retrieving gathering points...')
-    url = construct_xivapi_url(
-        'GatheringPointBase',
-        [
-            'Item[].value',
-            'GatheringType.value',
-            'Item[].GatheringItemLevel.value'
-        ]
-    )
-    gathering_points = get_paginated_data(url)
-    for gathering_point in gathering_points:
-        current_type = gathering_point['fields']['GatheringType']['value']
-        for item in gathering_point['fields']['Item']:
-            if item['value'] == 0:
+            craft_type = recipe['fields']['CraftType']['fields']['Name']
+            item_id = recipe['fields']['ItemResult']['value']
+            item_level = recipe['fields']['RecipeLevelTable']['fields']['ClassJobLevel']
+            self.emit('crafting', {'id': item_id, 'level': item_level}, craft_type)
+            ingredients = [
+                {'id': ingredient['value'], 'amount': amount}
+                for ingredient, amount in zip(
+                    recipe['fields']['Ingredient'],
+                    recipe['fields']['AmountIngredient']
+                )
+                if ingredient['value'] != 0 and amount > 0
+            ]
+            choose_recipe(
+                self.recipes,
+                item_id,
+                {
+                    'craft_type': craft_type,
+                    'level': item_level,
+                    'yield': recipe['fields']['AmountResult'],
+                    'ingredients': ingredients
+                }
+            )
+            for ingredient in ingredients:
+                self.uses.setdefault(ingredient['id'], set()).add(
+                    (item_level, item_id, craft_type)
+                )
+
+    def finish_recipes(self):
+        """
+        Builds the ingredient tree and raw materials of every recipe, and the index of the
+        recipes each item is used in, once all recipes are in.
+        """
+        self.outputs['recipes'] = build_recipes(self.recipes)
+        self.outputs['used_in'] = build_used_in(self.uses)
+        self.recipes.clear()
+        self.uses.clear()
+
+    def get_item_names(self):
+        """
+        Retrieves the names of every pulled item in each language, selecting items from the
+        Item sheet by row_id, or from its CSV exports, and encodes them into one string table.
+        """
+        print('Retrieving item names...')
+        item_ids = sorted(self.collect_item_ids())
+        rows = self.fetcher.get_rows('Item', SHEET_FIELDS['Item'], item_ids)
+        self.outputs['names'] = encode_names(rows)
+
+    def collect_item_ids(self):
+        """
+        Collects the ids of the items in every data file, whether loaded or emitted, including
+        recipe ingredients.
+        """
+        item_ids = {
+            item_id
+            for groups in self.records.values()
+            for levels in groups.values()
+            for item_id in levels
+        }
+        item_ids.update(recipe_item_ids(self.recipes))
+        for output, data in self.outputs.items():
+            if output in ('names', 'used_in'):
+                continue
+            if output == 'recipes':
+                item_ids.update(recipe_item_ids(data))
                 continue
-            gathering_items_for_lookup[item['value']] = {
-                'type': current_type,
-                'level': item['fields']['GatheringItemLevel']['value']
+            for records in data.values() if isinstance(data, dict) else [data]:
+                item_ids.update(record['id'] for record in records)
+        return item_ids
+
+    def get_unchanged_sheets(self, recorded, output_sheets):
+        """
+        Finds sheets whose data files can be carried over from the current snapshot.
+        """
+        if self.fetcher.game_version == LATEST_VERSION \
+                or recorded.get('game_version') != self.fetcher.game_version \
+                or recorded.get('record_order') != RECORD_ORDER:
+            return set()
+        if recorded.get('schema') != self.fetcher.schema:
+            return set()
+        recorded_sheets = recorded.get('sheets', {})
+        reusable_outputs = {
+            output for output, sheet_names in output_sheets.items()
+            if os.path.exists(self.previous_path(output)) and all(
+                recorded_sheets.get(sheet_name, {}).get('fields') == SHEET_FIELDS[sheet_name]
+                for sheet_name in sheet_names
+            )
+        }
+        return {
+            sheet_name for sheet_name in SHEET_FIELDS
+            if any(sheet_name in sheet_names for sheet_names in output_sheets.values()) and all(
+                output in reusable_outputs
+                for output, sheet_names in output_sheets.items()
+                if sheet_name in sheet_names
+            )
+        }
+
+    def load_file(self, file_name, data):
+        """
+        Loads a data file from the previous snapshot into the given list or dict.
+        """
+        if file_name == 'names':
+            data.update(read_names(self.previous_path(file_name)))
+            return
+        if file_name in ('recipes', 'used_in'):
+            data.update(read_recipes(self.previous_path(file_name)))
+            return
+        with open(self.previous_path(file_name), 'r', encoding='utf-8') as f:
+            loaded = json.load(f)
+        if isinstance(data, dict):
+            data.update(loaded)
+        else:
+            data.extend(loaded)
+
+    def get_stages(self, stream=False, joined_gathering=False):
+        """
+        Chooses the stages to run and binds them to this puller. Streaming stages turn rows into
+        records as pages arrive rather than holding whole sheets, and the joined gathering stage
+        replaces the three gathering sheet crawls with a single crawl of gathering points.
+        """
+        stages = dict(STREAM_STAGES if stream else PULL_STAGES)
+        if joined_gathering:
+            for name in [name for name in stages if STAGE_SHEETS[name] == GATHERING_SHEETS]:
+                del stages[name]
+            stages.update(JOINED_GATHERING_STAGES)
+        return {
+            name: (self.instrument_stage(name, getattr(self, method)), args, dependencies)
+            for name, (method, args, dependencies) in stages.items()
+        }
+
+    def instrument_stage(self, name, function):
+        """
+        Wraps a stage's function so that its timings are recorded, and when profiling, its
+        allocations.
+        """
+        function = self.metrics.timed_stage(name, function)
+        if self.profiler is not None:
+            function = self.profiler.stage(name, function)
+        return function
+
+    def pull(self, force=False, stream=False, joined_gathering=False, names=False):
+        """
+        Pulls crafting and gathering data from XIVAPI into a new snapshot and returns it as a
+        dataset.
+        """
+        with self.pull_lock:
+            self.start_pull()
+            session_stats = self.fetcher.session.stats()
+            output_sheets = dict(OUTPUT_SHEETS)
+            if names:
+                output_sheets['names'] = NAME_SHEETS
+                self.outputs['names'] = {}
+            self.fetcher.use_game_version(
+                self.fetcher.get_game_version(),
+                SCHEMA_PROBE_SHEET,
+                SHEET_FIELDS[SCHEMA_PROBE_SHEET]
+            )
+            self.previous_snapshot = current_snapshot(self.data_dir)
+            previous_manifest = read_manifest(self.previous_snapshot)
+            unchanged_sheets = set() if force else self.get_unchanged_sheets(
+                previous_manifest,
+                output_sheets
+            )
+            if unchanged_sheets:
+                print(f'Skipping sheets unchanged in game version {self.fetcher.game_version}: '
+                      f'{", ".join(sorted(unchanged_sheets))}')
+            refreshed = {
+                output for output, sheet_names in output_sheets.items()
+                if not set(sheet_names) <= unchanged_sheets
             }
+            self.expect_rows(
+                previous_manifest.get('rows', {}),
+                {sheet_name for sheet_names in output_sheets.values() for sheet_name in sheet_names}
+                - unchanged_sheets
+            )
+            if refreshed:
+                self.snapshot = create_snapshot(self.data_dir)
+            for output in sorted(set(output_sheets) - refreshed):
+                self.reuse_output(
+                    output,
+                    previous_manifest,
+                    load=not stream or 'names' in refreshed
+                )
+            if stream:
+                self.open_writers(refreshed - {'names', 'recipes', 'used_in'})
+            stages = {
+                name: stage
+                for name, stage in self.get_stages(stream, joined_gathering).items()
+                if not set(STAGE_SHEETS[name]) <= unchanged_sheets
+            }
+            if 'names' in refreshed:
+                stages['item names'] = (
+                    self.instrument_stage('item names', self.get_item_names),
+                    (),
+                    tuple(stages)
+                )
+            progress_line = ProgressLine(self.metrics) if self.progress else None
+            if progress_line is not None:
+                progress_line.start()
+            try:
+                run_stages(stages)
+            except:
+                self.abandon_pull()
+                raise
+            finally:
+                if progress_line is not None:
+                    progress_line.stop()
+            self.finish_records()
+            if 'recipes' in refreshed:
+                self.finish_recipes()
+            for writer in self.writers.values():
+                writer.close()
+            self.metrics.finish()
+            pulled_stats = self.fetcher.session.stats()
+            return Dataset.build(
+                self.fetcher.game_version,
+                self.fetcher.schema,
+                self.outputs,
+                {output: self.count_records(output) for output in self.outputs},
+                refreshed,
+                self.writers,
+                self.snapshot,
+                self.metrics.report({
+                    name: pulled_stats[name] - session_stats[name] for name in session_stats
+                })
+            )
+
+    def expect_rows(self, previous_rows, pulled_sheets):
+        """
+        Tells the progress line how many rows to expect, if the last pull counted every sheet
+        being pulled.
+        """
+        if all(sheet_name in previous_rows for sheet_name in pulled_sheets):
+            self.metrics.expected_rows = sum(
+                previous_rows[sheet_name] for sheet_name in pulled_sheets
+            )
 
-def get_gathering_items():
+    def abandon_pull(self):
+        """
+        Discards the files and snapshot of a pull that failed, leaving the current snapshot as
+        it was.
+        """
+        for writer in self.writers.values():
+            writer.discard()
+        self.writers.clear()
+        if self.snapshot is not None:
+            discard_snapshot(self.snapshot)
+
+    def reuse_output(self, output, manifest, load):
+        """
+        Reuses a data file whose sheets are unchanged from the previous snapshot, loading it
+        into the dataset or, when streaming, only taking its record count from the manifest,
+        and carries it over into the new snapshot if one is being built.
+        """
+        if load:
+            self.load_file(output, self.outputs[output])
+        else:
+            self.reused_counts[output] = manifest['files'][f'{output}.json']['records']
+        if self.snapshot is not None:
+            carry_over(self.snapshot, self.previous_path(output), self.compressions)
+
+    def open_writers(self, outputs):
+        """
+        Opens incremental writers for the given data files, so their records are written as
+        they are finished rather than held in the dataset.
+        """
+        for output in outputs:
+            self.writers[output] = open_writer(
+                self.snapshot_path(output),
+                grouped=isinstance(self.outputs[output], dict)
+            )
+
+    def count_records(self, output):
+        """
+        Counts the records pulled or loaded for a data file.
+        """
+        if output in self.writers:
+            return self.writers[output].count
+        if output in self.reused_counts:
+            return self.reused_counts[output]
+        if output == 'names':
+            return len(self.outputs[output].get('items', {}))
+        if output in ('recipes', 'used_in'):
+            return len(self.outputs[output])
+        if isinstance(self.outputs[output], dict):
+            return sum(len(records) for records in self.outputs[output].values())
+        return len(self.outputs[output])
+
+    def save(self, dataset):
+        """
+        Writes a dataset into its snapshot with a manifest and publishes it, returning whether
+        the content changed.
+        """
+        for output in sorted(dataset.refreshed - dataset.streamed):
+            write_file(
+                os.path.join(dataset.snapshot, f'{output}.json'),
+                dataset.outputs[output],
+                self.compressions
+            )
+        for output in sorted(dataset.counts):
+            write_compressed(os.path.join(dataset.snapshot, f'{output}.json'), self.compressions)
+        counts = {
+            f'{output}.json{suffix}': count
+            for output, count in dataset.counts.items()
+            for suffix in [''] + [f'.{compression}' for compression in self.compressions]
+        }
+        if self.sqlite:
+            write_snapshot_database(dataset.snapshot)
+            counts[DATABASE] = sum(dataset.counts[category] for category in CATEGORIES)
+        current_manifest = read_manifest(current_snapshot(self.data_dir))
+        rows = dict(current_manifest.get('rows', {}))
+        rows.update({name: sheet['rows'] for name, sheet in dataset.report['sheets'].items()})
+        manifest = write_manifest(
+            dataset.snapshot,
+            {
+                'game_version': dataset.game_version,
+                'schema': dataset.schema,
+                'sheets': {name: {'fields': fields} for name, fields in SHEET_FIELDS.items()},
+                'rows': rows,
+                'record_order': RECORD_ORDER
+            },
+            counts
+        )
+        changed = manifest['content_sha256'] != current_manifest.get('content_sha256')
+        if is_redundant(
+            manifest,
+            current_manifest,
+            ('game_version', 'schema', 'sheets', 'record_order')
+        ):
+            print(f'Pulled data is identical to the current snapshot, discarding '
+                  f'{os.path.relpath(dataset.snapshot, self.data_dir)}.')
+            discard_snapshot(dataset.snapshot)
+        else:
+            publish_snapshot(self.data_dir, dataset.snapshot)
+            print(f'Published data snapshot '
+                  f'{os.path.relpath(dataset.snapshot, self.data_dir)}.')
+        if self.fetcher.page_cache is not None:
+            self.fetcher.page_cache.clear_checkpoints()
+        return changed
+
+def sort_records(records):
     """
-    Retrieves gathering items from XIVAPI.
+    Sorts records by level and then id.
     """
-    print('Retrieving gathering items...')
-    url = construct_xivapi_url('GatheringItem', ['Item.value'])
-    gathering_items = get_paginated_data(url)
-    for gathering_item in gathering_items:
-        item_id = gathering_item['fields']['Item']['value']
-        if gathering_item['row_id'] in gathering_items_for_lookup:
-            items.append(
-                {
-                    'id': item_id,
-                    'level': gathering_items_for_lookup[gathering_item['row_id']]['level'],
-                    'type': gathering_items_for_lookup[gathering_item['row_id']]['type']
-                }
-            )
+    return sorted(records, key=lambda record: (record['level'], record['id']))
 
-def convert_gathering_item_levels():
+def write_file(path, data, compressions=()):
     """
-    Converts gathering item levels to raw levels.
+    Writes data to a file, including data frozen in a dataset, optionally with compressed
+    siblings in the given formats
     """
-    print('Converting gathering item levels...')
-    url = construct_xivapi_url('GatheringItemLevelConvertTable', ['GatheringItemLevel'])
-    level_conversions = get_paginated_data(url)
-    for item in items:
-        lookup = level_conversions[item['level']]
-        item['level'] = lookup['fields']['GatheringItemLevel']
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(data, default=dict))
+    write_compressed(path, compressions)
 
-def sort_mining_and_botany_items():
+def parse_args():
     """
-    Sorts mining and botany items.
+    Parses command line arguments.
     """
-    print('Sorting mining and botany items...')
-    for item in items:
-        if item['type'] in mining_types:
-            mining_items.append({'id': item['id'], 'level': item['level']})
-        elif item['type'] in botany_types:
-            botany_items.append({'id': item['id'], 'level': item['level']})
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--mirror',
+        metavar='URL',
+        action='append',
+        default=[],
+        help=f'an endpoint equivalent to {XIVAPI_URL}, such as a mirror or a local caching '
+             'proxy; requests go to the fastest healthy endpoint and slow ones are hedged to '
+             'another; can be given more than once'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='pull every sheet even if the game version has not changed since the last pull'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=CACHE_DIR,
+        help='directory to cache retrieved pages and resume checkpoints in'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='retrieve every page from XIVAPI without caching it'
+    )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='turn rows into records as pages arrive instead of holding whole sheets; this '
+             'bounds the memory spent on pages and rows, but the id and level of every record '
+             'are still held until the end so that records can be deduplicated and sorted'
+    )
+    gathering_group = parser.add_mutually_exclusive_group()
+    gathering_group.add_argument(
+        '--joined-gathering',
+        action='store_true',
+        help='join gathering items in a single crawl of gathering points'
+    )
+    gathering_group.add_argument(
+        '--verify-gathering-join',
+        action='store_true',
+        help='pull everything with the three-pass gathering join, then check that the '
+             'single-pass join gives the same gathering items; implies --force'
+    )
+    parser.add_argument(
+        '--names',
+        action='store_true',
+        help='also pull the names of every item in ' + ', '.join(LANGUAGES) + ' into a shared '
+             'string table'
+    )
+    parser.add_argument(
+        '--compress',
+        metavar='FORMATS',
+        type=lambda formats: [compression for compression in formats.split(',') if compression],
+        default=[],
+        help='also write every data file compressed at maximum level in each of the given '
+             f'comma-separated formats ({", ".join(FORMATS)}), such as mining.json.gz'
+    )
+    parser.add_argument(
+        '--sqlite',
+        action='store_true',
+        help=f'also write every item into an SQLite database, {DATABASE}, with a table per '
+             'category, for server.py --sqlite'
+    )
+    parser.add_argument(
+        '--report',
+        metavar='REPORT_FILE',
+        help='write a JSON report of request latencies, bytes, retries, rows per sheet and '
+             'stage timings to a file'
+    )
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help='keep running, pulling again on a schedule with the same connections and page '
+             'cache; --force applies to the first pull only'
+    )
+    parser.add_argument(
+        '--every-hours',
+        type=float,
+        default=DAEMON_EVERY_HOURS,
+        help=f'hours between pulls in daemon mode; {DAEMON_EVERY_HOURS} by default'
+    )
+    parser.add_argument(
+        '--jitter-minutes',
+        type=float,
+        default=DAEMON_JITTER_MINUTES,
+        help='wait up to this many extra minutes, chosen at random, before each pull in '
+             f'daemon mode; {DAEMON_JITTER_MINUTES} by default'
+    )
+    parser.add_argument(
+        '--notify-server',
+        metavar='PID_FILE',
+        nargs='?',
+        const=SERVER_PID_FILE,
+        help='send SIGHUP to the server whose process id is in a file, '
+             f'{SERVER_PID_FILE} by default, whenever a pull changes the published data'
+    )
+    parser.add_argument(
+        '--profile',
+        metavar='PROFILE_DIR',
+        help=f'profile the pull and write {PSTATS_FILE} for pstats, {COLLAPSED_FILE} for flame '
+             f'graphs and the top allocation sites of each stage in {ALLOCATIONS_FILE} to a '
+             'directory'
+    )
+    parser.add_argument(
+        '--csv-dir',
+        metavar='CSV_DIR',
+        help='read sheets from datamining CSV exports in a directory, such as Recipe.csv, '
+             'instead of crawling XIVAPI; names in other languages come from exports such as '
+             'Item.ja.csv'
+    )
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument(
+        '--record',
+        metavar='CASSETTE_DIR',
+        help='save every response received from XIVAPI to a cassette directory; implies --force'
+    )
+    cassette_group.add_argument(
+        '--replay',
+        metavar='CASSETTE_DIR',
+        help='serve every response from a recorded cassette directory without the network; '
+             'implies --force and --no-cache'
+    )
+    args = parser.parse_args()
+    for compression in args.compress:
+        if compression not in FORMATS:
+            parser.error(f'unknown compression format {compression}')
+        if not is_available(compression):
+            parser.error(f'compressing to {compression} needs {LIBRARIES[compression]} installed')
+    if args.verify_gathering_join and args.stream:
+        parser.error('--verify-gathering-join needs the three-pass join to keep its items, '
+                     'so it cannot be used with --stream')
+    if args.daemon and (args.verify_gathering_join or args.replay):
+        parser.error('--daemon pulls from XIVAPI on a schedule, so it cannot be used with '
+                     '--verify-gathering-join or --replay')
+    if args.csv_dir and (args.record or args.replay or args.mirror):
+        parser.error('--csv-dir reads no responses from XIVAPI, so it cannot be used with '
+                     '--record, --replay or --mirror')
+    if args.daemon and args.profile:
+        parser.error('--profile covers a single pull, so it cannot be used with --daemon')
+    if args.every_hours <= 0 or args.jitter_minutes < 0:
+        parser.error('--every-hours must be positive and --jitter-minutes not negative')
+    return args
 
-def get_fishing_spots():
+def notify_server(pid_file):
     """
-    Retrieves fishing spots from XIVAPI.
+    Asks the server whose process id is in a file to reload the current snapshot, by sending it
+    SIGHUP.
     """
-    print('Retrieving fishing spots...')
-    url = construct_xivapi_url('FishingSpot', ['Item[].value', 'GatheringLevel'])
-    fishing_spots = get_paginated_data(url)
-    for fishing_spot in fishing_spots:
-        for item in fishing_spot['fields']['Item']:
-            if item['value'] == 0:
-                continue
-            fishing_items.append(
-                {
-                    'id': item['value'],
-                    'level': fishing_spot['fields']['GatheringLevel']
-                }
-            )
+    try:
+        with open(pid_file, 'r', encoding='utf-8') as f:
+            pid = int(f.read())
+        os.kill(pid, signal.SIGHUP)
+    except (OSError, ValueError) as error:
+        print(f'Could not notify the server through {pid_file}: {error}')
+        return
+    print(f'Notified server process {pid} to reload the current snapshot.')
 
-def get_recipes():
+def print_counts(dataset, stream=False):
     """
-    Retrieves recipes from XIVAPI.
+    Prints how many records each data file of a dataset has, leaving out those carried over
+    without loading when streaming.
     """
-    print('Retrieving recipes...')
-    url = construct_xivapi_url(
-        'Recipe',
-        [
-            'CraftType.Name',
-            'ItemResult.Value',
-            'RecipeLevelTable.ClassJobLevel'
-        ]
-    )
-    recipes = get_paginated_data(url)
-    for recipe in recipes:
-        if recipe['fields']['ItemResult']['value'] == 0:
+    for output, count in dataset.counts.items():
+        if stream and output not in dataset.refreshed:
             continue
-        craft_type = recipe['fields']['CraftType']['fields']['Name']
-        item_id = recipe['fields']['ItemResult']['value']
-        item_level = recipe['fields']['RecipeLevelTable']['fields']['ClassJobLevel']
-        if craft_type not in crafting_items:
-            crafting_items[craft_type] = []
-        crafting_items[craft_type].append({'id': item_id, 'level': item_level})
+        if output == 'names':
+            print(f'Item names: {count} '
+                  f'({len(dataset.outputs[output]["strings"])} distinct strings)')
+        elif output == 'recipes':
+            print(f'Recipes: {count}')
+        elif output == 'used_in':
+            print(f'Ingredients used in recipes: {count}')
+        else:
+            print(f'{output.capitalize()} items: {count}')
 
-def pull_data():
+def pull_once(puller, args, force):
     """
-    Pulls crafting and gathering data from XIVAPI.
+    Pulls data, publishes it if it changed and reports on the pull. Returns whether the
+    published content changed.
     """
-    get_gathering_points()
-    get_gathering_items()
-    convert_gathering_item_levels()
-    sort_mining_and_botany_items()
-    get_fishing_spots()
-    get_recipes()
+    dataset = puller.pull(force, args.stream, args.joined_gathering, args.names)
+    if args.verify_gathering_join and not puller.verify_joined_gathering():
+        discard_snapshot(dataset.snapshot)
+        sys.exit(1)
+    if not dataset.refreshed:
+        print(f'Game data unchanged since the last pull (version {dataset.game_version}), '
+              f'nothing to do.')
+        return False
+    if puller.profiler is None:
+        changed = puller.save(dataset)
+    else:
+        changed = puller.profiler.stage('save', puller.save)(dataset)
+    print('Data successfully pulled and stored in JSON files.')
+    print_counts(dataset, args.stream)
+    puller.fetcher.print_summary(dataset.report)
+    if args.report:
+        write_file(args.report, dataset.report)
+        print(f'Run report written to {args.report}')
+    return changed
 
-def write_file(file_name, data):
+def run_daemon(puller, args):
     """
-    Writes data to a file
+    Pulls data over and over on a schedule with the same puller, notifying the server whenever
+    the published content changes.
     """
-    with open(f'data/{file_name}.json', 'w', encoding='utf-8') as f:
-        f.write(json.dumps(data))
+    force = args.force
+    while True:
+        try:
+            changed = pull_once(puller, args, force)
+        except Exception as error: # pylint: disable=broad-exception-caught
+            print(f'Pulling data failed: {error}')
+        else:
+            force = False
+            if changed and args.notify_server:
+                notify_server(args.notify_server)
+        delay = args.every_hours * 3600 + random.uniform(0, args.jitter_minutes * 60)
+        print(f'Next pull in {delay / 60:.0f} minutes.')
+        time.sleep(delay)
 
 def main():
     """
     Main function that pulls data and stores it in JSON files
     """
-    pull_data()
-    if not os.path.exists('data') or not os.path.isdir('data'):
-        os.mkdir('data')
-    write_file('mining', mining_items)
-    write_file('botany', botany_items)
-    write_file('fishing', fishing_items)
-    write_file('crafting', crafting_items)
-    print('Data successfully pulled and stored in JSON files.')
-    print(f'Mining items: {len(mining_items)}')
-    print(f'Botany items: {len(botany_items)}')
-    print(f'Fishing items: {len(fishing_items)}')
-    crafting_item_total = 0
-    for _,v in crafting_items.items():
-        crafting_item_total += len(v)
-    print(f'Crafting items: {crafting_item_total}')
+    args = parse_args()
+    cassette = None
+    page_cache = None
+    if args.replay:
+        cassette = Cassette(args.replay, replaying=True)
+        args.force = True
+    elif args.record:
+        cassette = Cassette(args.record)
+        args.force = True
+    if args.verify_gathering_join:
+        args.force = True
+    if not args.no_cache and not args.replay:
+        page_cache = PageCache(args.cache_dir)
+    if not os.path.exists(DATA_DIR) or not os.path.isdir(DATA_DIR):
+        os.mkdir(DATA_DIR)
+    puller = Puller(
+        mirror_urls=args.mirror,
+        page_cache=page_cache,
+        cassette=cassette,
+        compressions=args.compress,
+        sqlite=args.sqlite,
+        progress=sys.stderr.isatty(),
+        profiler=Profiler(args.profile) if args.profile else None,
+        csv_dir=args.csv_dir
+    )
+    if args.daemon:
+        run_daemon(puller, args)
+        return
+    if puller.profiler is not None:
+        puller.profiler.start()
+    try:
+        changed = pull_once(puller, args, args.force)
+    finally:
+        if puller.profiler is not None:
+            puller.profiler.stop()
+            print(f'Profile written to {args.profile}')
+    if changed and args.notify_server:
+        notify_server(args.notify_server)
 
 if __name__=='__main__':
     main()
@@ -0,0 +1,128 @@
+"""
+Recipe ingredient trees, with the raw materials each recipe needs flattened into totals, and
+an index of the recipes each item is used in.
+"""
+import json
+
+def choose_recipe(recipes, item_id, recipe):
+    """
+    Keeps a recipe for its result item if it is the item's first, or has a lower level than the
+    one kept so far. Between recipes of the same level, the first craft type in sorted order
+    wins.
+    """
+    kept = recipes.get(item_id)
+    if kept is None \
+            or (recipe['level'], recipe['craft_type']) < (kept['level'], kept['craft_type']):
+        recipes[item_id] = recipe
+
+def build_recipes(recipes):
+    """
+    Completes recipes, given as {result item id: {'craft_type', 'level', 'yield', 'ingredients'}}
+    with ingredients as [{'id', 'amount'}], into ingredient trees. Every ingredient that has a
+    recipe of its own gets the number of times that recipe must be crafted, 'crafts', which
+    links it into the tree, and every recipe gets the raw materials one craft of it needs in
+    total, as 'materials' sorted by id. Materials are counted once per recipe and shared by
+    every recipe that uses it. An ingredient whose recipe would need the recipe being counted,
+    directly or not, is counted as a raw material instead.
+    """
+    materials = {}
+    for item_id in sorted(recipes):
+        count_materials(recipes, item_id, materials, set())
+    return {
+        item_id: {
+            **recipes[item_id],
+            'materials': [
+                {'id': material, 'amount': amount}
+                for material, amount in sorted(materials[item_id].items())
+            ]
+        }
+        for item_id in sorted(recipes)
+    }
+
+def count_materials(recipes, item_id, materials, visiting):
+    """
+    Counts the raw materials one craft of an item's recipe needs, remembering the counts of
+    every recipe along the way in materials. Recipes being counted further up are in visiting.
+    """
+    if item_id in materials:
+        return materials[item_id]
+    visiting.add(item_id)
+    totals = {}
+    for ingredient in recipes[item_id]['ingredients']:
+        ingredient_id = ingredient['id']
+        if ingredient_id in recipes and ingredient_id not in visiting:
+            crafts = -(-ingredient['amount'] // max(1, recipes[ingredient_id]['yield']))
+            ingredient['crafts'] = crafts
+            for material, amount in count_materials(
+                recipes,
+                ingredient_id,
+                materials,
+                visiting
+            ).items():
+                totals[material] = totals.get(material, 0) + amount * crafts
+        else:
+            totals[ingredient_id] = totals.get(ingredient_id, 0) + ingredient['amount']
+    visiting.discard(item_id)
+    materials[item_id] = totals
+    return totals
+
+def build_used_in(uses):
+    """
+    Builds the index of the recipes each ingredient is used in from {ingredient id: set of
+    (level, result item id, craft type)}, as {ingredient id: [{'craft_type', 'level', 'id'}]}
+    ordered by level, result item id and craft type, for level range lookups.
+    """
+    return {
+        ingredient_id: [
+            {'craft_type': craft_type, 'level': level, 'id': item_id}
+            for level, item_id, craft_type in sorted(uses[ingredient_id])
+        ]
+        for ingredient_id in sorted(uses)
+    }
+
+def recipe_item_ids(recipes):
+    """
+    Yields the ids of every item in recipes, whether made or used.
+    """
+    for item_id, recipe in recipes.items():
+        yield item_id
+        for ingredient in recipe['ingredients']:
+            yield ingredient['id']
+
+def read_recipes(path):
+    """
+    Reads recipes, or the index of the recipes items are used in, from a data file.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return decode_recipes(json.load(f))
+
+def decode_recipes(recipes):
+    """
+    Turns the item ids of recipes, or of the index of their uses, read from JSON back into
+    integers.
+    """
+    return {int(item_id): recipe for item_id, recipe in recipes.items()}
+
+def expand_recipe(recipes, item_id, trees, name=None):
+    """
+    Expands an item's recipe into its full ingredient tree, with the recipe of every ingredient
+    that is crafted nested under it as 'recipe'. Trees are remembered in trees, so subtrees
+    shared between recipes are expanded once. With a name function, every item in the tree
+    also gets its name.
+    """
+    if item_id in trees:
+        return trees[item_id]
+    recipe = recipes[item_id]
+    tree = {'id': item_id, **recipe}
+    tree['ingredients'] = []
+    for ingredient in recipe['ingredients']:
+        node = dict(ingredient)
+        if 'crafts' in ingredient:
+            node['recipe'] = expand_recipe(recipes, ingredient['id'], trees, name)
+        tree['ingredients'].append(node)
+    tree['materials'] = [dict(material) for material in recipe['materials']]
+    if name is not None:
+        for node in [tree] + tree['ingredients'] + tree['materials']:
+            node['name'] = name(node['id'])
+    trees[item_id] = tree
+    return tree
@@ -0,0 +1,236 @@
+"""
+Timings and counts gathered while pulling, reported as JSON and as a live progress line.
+"""
+import sys
+import threading
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PERCENTILES = (50, 90, 99)
+PROGRESS_INTERVAL = 1.0
+
+def percentile(values, rank):
+    """
+    Finds a nearest-rank percentile of a sorted list of values.
+    """
+    if not values:
+        return None
+    return values[max(0, -(-len(values) * rank // 100) - 1)]
+
+def latency_percentiles(latencies):
+    """
+    Reports percentiles of a sorted list of latencies in milliseconds.
+    """
+    return {
+        f'p{rank}': round(percentile(latencies, rank) * 1000, 1)
+        for rank in PERCENTILES if latencies
+    }
+
+def peak_rss_bytes():
+    """
+    Reports the peak resident set size of the process, where the platform can tell.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class RunMetrics:
+    """
+    Collects what a pull spent its time on: HTTP request latencies and statuses, JSON decoding,
+    where each page came from, rows per sheet, and the wall and CPU time of each stage. Stage
+    CPU time is that of the thread running the stage, which leaves out shard threads. Every
+    method can be called from any thread.
+    """
+    def __init__(self, expected_rows=None):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.started_cpu = time.process_time()
+        self.finished = None
+        self.finished_cpu = None
+        self.expected_rows = expected_rows
+        self.latencies = []
+        self.statuses = {}
+        self.endpoints = {}
+        self.hedges = {'sent': 0, 'won': 0}
+        self.decode_seconds = 0.0
+        self.page_sources = {}
+        self.sheets = {}
+        self.stages = {}
+        self.rows = 0
+
+    def record_request(self, latency, status, endpoint=None):
+        """
+        Records an HTTP request's latency and status, or None for a failed connection, and the
+        endpoint it was sent to.
+        """
+        with self.lock:
+            self.latencies.append(latency)
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            if endpoint is not None:
+                counts = self.endpoints.setdefault(endpoint, {'latencies': [], 'errors': 0})
+                counts['latencies'].append(latency)
+                if status is None or status == 429 or status >= 500:
+                    counts['errors'] += 1
+
+    def record_hedge(self, won):
+        """
+        Records a request hedged to a second endpoint, and whether the hedge answered first.
+        """
+        with self.lock:
+            self.hedges['sent'] += 1
+            if won:
+                self.hedges['won'] += 1
+
+    def record_decode(self, seconds):
+        """
+        Records time spent decoding a JSON response.
+        """
+        with self.lock:
+            self.decode_seconds += seconds
+
+    def record_page(self, sheet_name, source, seconds):
+        """
+        Records a page retrieved from the network, the page cache or a cassette, and how long
+        retrieving it took, retries included.
+        """
+        with self.lock:
+            self.page_sources[source] = self.page_sources.get(source, 0) + 1
+            sheet = self.get_sheet(sheet_name)
+            sheet['pages'] += 1
+            sheet['page_seconds'] += seconds
+
+    def record_rows(self, sheet_name, rows):
+        """
+        Records rows of a sheet handed on to the stages.
+        """
+        with self.lock:
+            self.get_sheet(sheet_name)['rows'] += rows
+            self.rows += rows
+
+    def get_sheet(self, sheet_name):
+        """
+        Retrieves the counts for a sheet, starting them if needed. Must hold the lock.
+        """
+        if sheet_name not in self.sheets:
+            self.sheets[sheet_name] = {'rows': 0, 'pages': 0, 'page_seconds': 0.0}
+        return self.sheets[sheet_name]
+
+    def timed_stage(self, name, function):
+        """
+        Wraps a stage's function so that its wall and CPU time are recorded.
+        """
+        def run(*args):
+            started = time.perf_counter()
+            started_cpu = time.thread_time()
+            try:
+                return function(*args)
+            finally:
+                with self.lock:
+                    self.stages[name] = {
+                        'wall_seconds': round(time.perf_counter() - started, 3),
+                        'cpu_seconds': round(time.thread_time() - started_cpu, 3)
+                    }
+        return run
+
+    def finish(self):
+        """
+        Marks the end of the pull.
+        """
+        self.finished = time.perf_counter()
+        self.finished_cpu = time.process_time()
+
+    def progress(self):
+        """
+        Describes progress so far: rows, rows per second and, when the previous pull's row
+        counts are known, an estimated time to go.
+        """
+        with self.lock:
+            rows = self.rows
+            pages = sum(self.page_sources.values())
+        elapsed = time.perf_counter() - self.started
+        rate = rows / elapsed if elapsed > 0 else 0.0
+        line = f'{rows} rows from {pages} pages, {rate:.0f} rows/s'
+        if self.expected_rows and rate > 0:
+            line += f', ETA {max(0.0, (self.expected_rows - rows) / rate):.0f}s'
+        return line
+
+    def report(self, session_stats=None):
+        """
+        Builds the run report. Session stats, as counted over the pull, give bytes and retries.
+        """
+        finished = self.finished if self.finished is not None else time.perf_counter()
+        finished_cpu = self.finished_cpu if self.finished_cpu is not None else time.process_time()
+        with self.lock:
+            latencies = sorted(self.latencies)
+            report = {
+                'wall_seconds': round(finished - self.started, 3),
+                'cpu_seconds': round(finished_cpu - self.started_cpu, 3),
+                'peak_rss_bytes': peak_rss_bytes(),
+                'requests': {
+                    'count': len(latencies),
+                    'statuses': dict(self.statuses),
+                    'latency_ms': latency_percentiles(latencies),
+                    'max_latency_ms': round(latencies[-1] * 1000, 1) if latencies else None
+                },
+                'endpoints': {
+                    endpoint: {
+                        'requests': len(counts['latencies']),
+                        'errors': counts['errors'],
+                        'latency_ms': latency_percentiles(sorted(counts['latencies']))
+                    }
+                    for endpoint, counts in sorted(self.endpoints.items())
+                },
+                'hedges': dict(self.hedges),
+                'json_decode_seconds': round(self.decode_seconds, 3),
+                'pages': dict(self.page_sources),
+                'sheets': {
+                    name: dict(sheet, page_seconds=round(sheet['page_seconds'], 3))
+                    for name, sheet in sorted(self.sheets.items())
+                },
+                'stages': dict(self.stages)
+            }
+        if session_stats is not None:
+            report['bytes'] = {
+                'wire': session_stats['wire_bytes'],
+                'decoded': session_stats['decoded_bytes']
+            }
+            report['retries'] = session_stats['retries']
+        return report
+
+class ProgressLine:
+    """
+    Keeps a single status line on a terminal up to date with a pull's progress.
+    """
+    def __init__(self, metrics, stream=sys.stderr, interval=PROGRESS_INTERVAL):
+        self.metrics = metrics
+        self.stream = stream
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        """
+        Rewrites the line every interval until stopped.
+        """
+        while not self.stopped.wait(self.interval):
+            self.stream.write(f'\r\033[K{self.metrics.progress()}')
+            self.stream.flush()
+
+    def start(self):
+        """
+        Starts updating the line.
+        """
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops updating the line and clears it.
+        """
+        self.stopped.set()
+        self.thread.join()
+        self.stream.write('\r\033[K')
+        self.stream.flush()
@@ -2,42 +2,266 @@
 Runs a web server for retrieving gathering and crafting data.
 """
 # pylint: disable=abstract-method
+import argparse
 import asyncio
 import json
+import os
+import signal
+from bisect import bisect_left, bisect_right
 import tornado.httpserver
-from tornado.web import Application, RequestHandler
+from tornado.web import Application, HTTPError, RequestHandler
+from compression import DECOMPRESSION_PREFERENCE, decompress, is_available
+from item_names import decode_names, get_name
+from page_cache import PageCache, write_atomically
+from pull_data import (
+    CACHE_DIR,
+    DATA_DIR,
+    RECORD_ORDER,
+    SERVER_PID_FILE,
+    Puller,
+    sort_records
+)
+from recipe_trees import decode_recipes, expand_recipe
+from snapshots import current_snapshot, read_manifest, read_verified, verify_file
+from sqlite_store import DATABASE, ItemDatabase
 
-botany_items = []
-mining_items = []
-fishing_items = []
-crafting_items = {}
+class ServedData:
+    """
+    Holds the items, item names, recipes and SQLite database being served.
+    """
+    def __init__(self):
+        self.items = {'botany': [], 'mining': [], 'fishing': [], 'crafting': {}}
+        self.item_names = None
+        self.item_database = None
+        self.recipes = None
+        self.recipe_trees = {}
+        self.used_in = None
+
+    def use(self, items):
+        """
+        Serves the given items in place of the ones loaded so far, answering from their SQLite
+        database if they have one. Item names are kept if the items have none. Recipe trees
+        expanded so far are forgotten along with the recipes they came from.
+        """
+        self.items = {category: items[category] for category in self.items}
+        self.item_names = items.get('names', self.item_names)
+        self.recipes = items.get('recipes')
+        self.recipe_trees = {}
+        self.used_in = items.get('used_in')
+        if self.item_database is not None:
+            self.item_database.close()
+        self.item_database = items.get('database')
 
-def load_json_file(file_name, variable):
+    def category_items(self, category, craft_type=None):
+        """
+        Finds the loaded items of a category, or of a craft type for crafting items, of which
+        there are none for an unknown craft type.
+        """
+        if category == 'crafting':
+            return self.items['crafting'].get(craft_type, [])
+        return self.items[category]
+
+served = ServedData()
+
+def read_data_file(snapshot, manifest, file_name):
+    """
+    Reads a JSON data file from a snapshot, checking it against the snapshot's manifest. A
+    compressed sibling is read and decompressed in place of the file when there is one that can
+    be decompressed, so snapshots can be shipped with their compressed files alone.
+    """
+    for compression in DECOMPRESSION_PREFERENCE:
+        compressed_name = f'{file_name}.json.{compression}'
+        if is_available(compression) and compressed_name in manifest['files'] \
+                and os.path.exists(os.path.join(snapshot, compressed_name)):
+            return json.loads(
+                decompress(read_verified(snapshot, manifest, compressed_name), compression)
+            )
+    return json.loads(read_verified(snapshot, manifest, f'{file_name}.json'))
+
+def order_records(manifest, records):
+    """
+    Sorts records by level and then id, unless the snapshot's manifest says they were written
+    in that order.
+    """
+    if manifest.get('record_order') == RECORD_ORDER:
+        return records
+    return sort_records(records)
+
+def load_json_file(snapshot, manifest, file_name, variable):
     """
     Loads a JSON file into the specified list.
     """
-    with open(f'data/{file_name}.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        variable.extend(data)
+    variable.extend(order_records(manifest, read_data_file(snapshot, manifest, file_name)))
 
-def load_crafting_items(file_name):
+def load_crafting_items(snapshot, manifest, file_name, variable):
     """
-    Loads crafting items from a JSON file.
+    Loads crafting items from a JSON file into the specified dict.
     """
-    with open(f'data/{file_name}.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        for k,v in data.items():
-            crafting_items[k] = v
+    for k,v in read_data_file(snapshot, manifest, file_name).items():
+        variable[k] = order_records(manifest, v)
+
+def load_item_names(snapshot, manifest):
+    """
+    Loads item names if they have been pulled, or returns None.
+    """
+    if 'names.json' in manifest['files']:
+        return decode_names(read_data_file(snapshot, manifest, 'names'))
+    return None
+
+def load_recipes(snapshot, manifest, file_name='recipes'):
+    """
+    Loads recipes, or the index of the recipes items are used in, if they have been pulled, or
+    returns None.
+    """
+    if f'{file_name}.json' in manifest['files']:
+        return decode_recipes(read_data_file(snapshot, manifest, file_name))
+    return None
+
+def read_current_snapshot(sqlite=False):
+    """
+    Reads the data files of the current snapshot, refusing any that do not match its manifest,
+    and returns the manifest and the items. Every file is read from the snapshot the current
+    symlink pointed at when reading started, so a snapshot published meanwhile cannot be mixed
+    in. With sqlite, the items are left in the snapshot's SQLite database, which is opened
+    read-only, rather than loaded. Recipes and the recipes items are used in are always loaded.
+    """
+    snapshot = current_snapshot(DATA_DIR)
+    if snapshot is None:
+        raise SystemExit(f'No data snapshot has been published in {DATA_DIR}; run pull_data.py.')
+    manifest = read_manifest(snapshot)
+    items = {'botany': [], 'mining': [], 'fishing': [], 'crafting': {}, 'database': None}
+    if sqlite:
+        if DATABASE not in manifest['files']:
+            raise SystemExit(f'The current snapshot has no {DATABASE}; '
+                             f'run pull_data.py --sqlite --force.')
+        items['database'] = ItemDatabase(verify_file(snapshot, manifest, DATABASE))
+    else:
+        load_json_file(snapshot, manifest, 'botany', items['botany'])
+        load_json_file(snapshot, manifest, 'mining', items['mining'])
+        load_json_file(snapshot, manifest, 'fishing', items['fishing'])
+        load_crafting_items(snapshot, manifest, 'crafting', items['crafting'])
+    items['names'] = load_item_names(snapshot, manifest)
+    items['recipes'] = load_recipes(snapshot, manifest)
+    items['used_in'] = load_recipes(snapshot, manifest, 'used_in')
+    return manifest, items
+
+def load_current_snapshot(sqlite=False):
+    """
+    Loads the data files of the current snapshot, or opens its SQLite database.
+    """
+    manifest, items = read_current_snapshot(sqlite)
+    served.use(items)
+    print(f'Serving data for game version {manifest["game_version"]}, '
+          f'built at {manifest["built_at"]}.')
+
+def use_dataset(dataset):
+    """
+    Serves the items of a freshly pulled dataset in place of the ones loaded so far.
+    """
+    served.use(dataset.outputs)
+
+def refresh_data(puller):
+    """
+    Pulls data that has changed since the last pull, along with item names, publishes it as a
+    new snapshot and returns the dataset.
+    """
+    dataset = puller.pull(names=True)
+    if dataset.refreshed:
+        puller.save(dataset)
+    return dataset
+
+async def refresh_periodically(puller, interval, sqlite=False):
+    """
+    Refreshes the served items in the background every interval seconds, pulling on a worker
+    thread with the same puller so that its connections and page cache stay warm. With sqlite,
+    the database of the newly published snapshot is opened instead of serving the dataset. A
+    failed refresh keeps serving the items it already has.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            dataset = await loop.run_in_executor(None, refresh_data, puller)
+            if sqlite:
+                _, items = await loop.run_in_executor(None, read_current_snapshot, True)
+        except Exception as error: # pylint: disable=broad-exception-caught
+            print(f'Refreshing data failed: {error}')
+            continue
+        if sqlite:
+            served.use(items)
+        else:
+            use_dataset(dataset)
+        print(f'Serving data for game version {dataset.game_version}.')
+
+async def reload_on_signal(sqlite=False):
+    """
+    Reloads the current snapshot whenever the server receives SIGHUP, as pull_data.py sends
+    after publishing changed data, reopening its SQLite database with sqlite. Signals arriving
+    during a reload are handled by a single further reload. A failed reload keeps serving the
+    items the server already has.
+    """
+    loop = asyncio.get_running_loop()
+    requested = asyncio.Event()
+    loop.add_signal_handler(signal.SIGHUP, requested.set)
+    while True:
+        await requested.wait()
+        requested.clear()
+        try:
+            manifest, items = await loop.run_in_executor(None, read_current_snapshot, sqlite)
+        except (Exception, SystemExit) as error: # pylint: disable=broad-exception-caught
+            print(f'Reloading data failed: {error}')
+            continue
+        served.use(items)
+        print(f'Reloaded data for game version {manifest["game_version"]}, '
+              f'built at {manifest["built_at"]}.')
+
+def parse_args():
+    """
+    Parses command line arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--refresh-hours',
+        type=float,
+        default=0,
+        help='pull changed data from XIVAPI in the background this often; off by default'
+    )
+    parser.add_argument(
+        '--sqlite',
+        action='store_true',
+        help='answer item queries from the SQLite database of the current snapshot, written by '
+             'pull_data.py --sqlite, instead of loading every item into memory'
+    )
+    parser.add_argument(
+        '--pid-file',
+        default=SERVER_PID_FILE,
+        help='file to write the process id to, for pull_data.py --notify-server to signal '
+             'when the data changes'
+    )
+    return parser.parse_args()
 
 async def main():
     """
     Main function that starts the web server.
     """
-    load_json_file('botany', botany_items)
-    load_json_file('mining', mining_items)
-    load_json_file('fishing', fishing_items)
-    load_crafting_items('crafting')
-    application = Application([
+    args = parse_args()
+    load_current_snapshot(args.sqlite)
+    write_atomically(args.pid_file, str(os.getpid()))
+    reload = asyncio.create_task(reload_on_signal(args.sqlite)) # pylint: disable=unused-variable
+    if args.refresh_hours > 0:
+        puller = Puller(page_cache=PageCache(CACHE_DIR), sqlite=args.sqlite)
+        refresh = asyncio.create_task( # pylint: disable=unused-variable
+            refresh_periodically(puller, args.refresh_hours * 3600, args.sqlite)
+        )
+    http_server = tornado.httpserver.HTTPServer(make_application(), ssl_options=dict(certfile="/etc/letsencrypt/live/xivmarketstats.com/fullchain.pem", keyfile="/etc/letsencrypt/live/xivmarketstats.com/privkey.pem"))
+    http_server.listen(1414)
+    await asyncio.Event().wait()
+
+def make_application():
+    """
+    Makes the web application that answers requests for the served data.
+    """
+    return Application([
         (r'^/rest/botany-items/(.+)-(.+)$', BotanyItemsHandler),
         (r'^/rest/mining-items/(.+)-(.+)$', MiningItemsHandler),
         (r'^/rest/fishing-items/(.+)-(.+)$', FishingItemsHandler),
@@ -47,18 +271,59 @@ async def main():
         (r'^/rest/mining-items-count/(.+)-(.+)$', MiningItemsCountHandler),
         (r'^/rest/fishing-items-count/(.+)-(.+)$', FishingItemsCountHandler),
         (r'^/rest/crafting-items-count/(.*)/(.+)-(.+)$', CraftingItemsCountHandler),
+        (r'^/rest/recipe/(\d+)$', RecipeHandler),
+        (r'^/rest/used-in/(\d+)/(.+)-(.+)$', UsedInHandler),
     ])
-    http_server = tornado.httpserver.HTTPServer(application, ssl_options=dict(certfile="/etc/letsencrypt/live/xivmarketstats.com/fullchain.pem", keyfile="/etc/letsencrypt/live/xivmarketstats.com/privkey.pem"))
-    http_server.listen(1414)
-    await asyncio.Event().wait()
 
 def grab_items_for_level_range(items, min_level, max_level):
     """
-    Grabs items within a specified level range.
+    Grabs items within a specified level range from items sorted by level.
+    """
+    start = bisect_left(items, int(min_level), key=lambda item: item['level'])
+    end = bisect_right(items, int(max_level), key=lambda item: item['level'])
+    return [item['id'] for item in items[start:end]]
+
+def find_uses(item_id, min_level, max_level):
+    """
+    Finds the recipes an item is used in within a level range, from the index of uses, whose
+    uses of each item are sorted by level.
+    """
+    uses = served.used_in.get(int(item_id), [])
+    start = bisect_left(uses, int(min_level), key=lambda use: use['level'])
+    end = bisect_right(uses, int(max_level), key=lambda use: use['level'])
+    return uses[start:end]
+
+def find_items(category, min_level, max_level, craft_type=None):
+    """
+    Finds the ids of a category's items within a level range, from the SQLite database when
+    serving from one.
+    """
+    if served.item_database is not None:
+        return served.item_database.item_ids(
+            category,
+            int(min_level),
+            int(max_level),
+            craft_type
+        )
+    return grab_items_for_level_range(
+        served.category_items(category, craft_type),
+        min_level,
+        max_level
+    )
+
+def count_items(category, min_level, max_level, craft_type=None):
+    """
+    Counts a category's items within a level range, from the SQLite database when serving from
+    one.
     """
-    min_level = int(min_level)
-    max_level = int(max_level)
-    return [item['id'] for item in items if min_level <= item['level'] <= max_level]
+    if served.item_database is not None:
+        return served.item_database.count_items(
+            category,
+            int(min_level),
+            int(max_level),
+            craft_type
+        )
+    return len(find_items(category, min_level, max_level, craft_type))
 
 class BaseHandler(RequestHandler):
     """
@@ -76,6 +341,22 @@ class BaseHandler(RequestHandler):
         self.set_status(204)
         self.finish()
 
+    def write_items(self, item_ids):
+        """
+        Writes item ids, or with a lang argument, items with their ids and names in that
+        language.
+        """
+        language = self.get_argument('lang', None)
+        if language is None:
+            self.write(json.dumps(item_ids))
+            return
+        if served.item_names is None or language not in served.item_names['languages']:
+            raise HTTPError(400, f'No item names in {language}')
+        self.write(json.dumps([
+            {'id': item_id, 'name': get_name(served.item_names, item_id, language)}
+            for item_id in item_ids
+        ]))
+
 class BotanyItemsHandler(BaseHandler):
     """
     Request handler for botany items.
@@ -84,7 +365,7 @@ class BotanyItemsHandler(BaseHandler):
         """
         Retrieves botany items within a specified level range.
         """
-        self.write(json.dumps(grab_items_for_level_range(botany_items, min_level, max_level)))
+        self.write_items(find_items('botany', min_level, max_level))
 
 class MiningItemsHandler(BaseHandler):
     """
@@ -94,7 +375,7 @@ class MiningItemsHandler(BaseHandler):
         """
         Retrieves mining items within a specified level range.
         """
-        self.write(json.dumps(grab_items_for_level_range(mining_items, min_level, max_level)))
+        self.write_items(find_items('mining', min_level, max_level))
 
 class FishingItemsHandler(BaseHandler):
     """
@@ -104,7 +385,7 @@ class FishingItemsHandler(BaseHandler):
         """
         Retrieves fishing items within a specified level range
         """
-        self.write(json.dumps(grab_items_for_level_range(fishing_items, min_level, max_level)))
+        self.write_items(find_items('fishing', min_level, max_level))
 
 class CraftingItemsHandler(BaseHandler):
     """
@@ -114,15 +395,7 @@ class CraftingItemsHandler(BaseHandler):
         """
         Retrieves crafting items within a specified level range.
         """
-        self.write(
-            json.dumps(
-                grab_items_for_level_range(
-                    crafting_items[crafting_type],
-                    min_level,
-                    max_level
-                )
-            )
-        )
+        self.write_items(find_items('crafting', min_level, max_level, crafting_type))
 
 class CraftingTypesHandler(BaseHandler):
     """
@@ -132,7 +405,58 @@ class CraftingTypesHandler(BaseHandler):
         """
         Retrieves crafting types.
         """
-        self.write(json.dumps(list(crafting_items.keys())))
+        if served.item_database is not None:
+            self.write(json.dumps(served.item_database.craft_types()))
+        else:
+            self.write(json.dumps(sorted(served.items['crafting'])))
+
+class RecipeHandler(BaseHandler):
+    """
+    Request handler for recipe ingredient trees.
+    """
+    def get(self, item_id):
+        """
+        Retrieves the full ingredient tree of an item's recipe and the raw materials one craft
+        of it needs, with names in a language if a lang argument is given.
+        """
+        item_id = int(item_id)
+        if served.recipes is None or item_id not in served.recipes:
+            raise HTTPError(404, f'No recipe for item {item_id}')
+        language = self.get_argument('lang', None)
+        if language is not None and (
+            served.item_names is None or language not in served.item_names['languages']
+        ):
+            raise HTTPError(400, f'No item names in {language}')
+
+        def name(name_id):
+            return get_name(served.item_names, name_id, language)
+
+        self.write(json.dumps(expand_recipe(
+            served.recipes,
+            item_id,
+            served.recipe_trees.setdefault(language, {}),
+            name if language is not None else None
+        )))
+
+class UsedInHandler(BaseHandler):
+    """
+    Request handler for the recipes an item is used in.
+    """
+    def get(self, item_id, min_level, max_level):
+        """
+        Retrieves the recipes within a specified level range that use an item, with their craft
+        types, levels and result item ids, and names in a language if a lang argument is given.
+        """
+        if served.used_in is None:
+            raise HTTPError(404, 'No recipe ingredients have been pulled')
+        uses = [dict(use) for use in find_uses(item_id, min_level, max_level)]
+        language = self.get_argument('lang', None)
+        if language is not None:
+            if served.item_names is None or language not in served.item_names['languages']:
+                raise HTTPError(400, f'No item names in {language}')
+            for use in uses:
+                use['name'] = get_name(served.item_names, use['id'], language)
+        self.write(json.dumps(uses))
 
 class BotanyItemsCountHandler(BaseHandler):
     """
@@ -142,7 +466,7 @@ class BotanyItemsCountHandler(BaseHandler):
         """
         Retrieves the count of botany items within a specified level range.
         """
-        self.write(str(len(grab_items_for_level_range(botany_items, min_level, max_level))))
+        self.write(str(count_items('botany', min_level, max_level)))
 
 class MiningItemsCountHandler(BaseHandler):
     """
@@ -152,7 +476,7 @@ class MiningItemsCountHandler(BaseHandler):
         """
         Retrieves the count of mining items within a specified level range.
         """
-        self.write(str(len(grab_items_for_level_range(mining_items, min_level, max_level))))
+        self.write(str(count_items('mining', min_level, max_level)))
 
 class FishingItemsCountHandler(BaseHandler):
     """
@@ -162,7 +486,7 @@ class FishingItemsCountHandler(BaseHandler):
         """
         Retrieves the count of fishing items within a specified level range.
         """
-        self.write(str(len(grab_items_for_level_range(fishing_items, min_level, max_level))))
+        self.write(str(count_items('fishing', min_level, max_level)))
 
 class CraftingItemsCountHandler(BaseHandler):
     """
@@ -172,17 +496,7 @@ class CraftingItemsCountHandler(BaseHandler):
         """
         Retrieves the count of crafting items within a specified level range.
         """
-        self.write(
-            str(
-                len(
-                    grab_items_for_level_range(
-                        crafting_items[crafting_type],
-                        min_level,
-                        max_level
-                    )
-                )
-            )
-        )
+        self.write(str(count_items('crafting', min_level, max_level, crafting_type)))
 
 if __name__=='__main__':
     print('Starting server.')
@@ -0,0 +1,155 @@
+"""
+Declarative joins between XIVAPI sheets on hashed row_id indexes.
+"""
+
+class SheetGap(ValueError):
+    """
+    Raised when a sheet that should have every row in its row_id span is missing some.
+    """
+
+def get_field(row, path):
+    """
+    Reads a field from a row with an XIVAPI-style path, such as 'Item.value' or 'CraftType.Name'.
+    Each segment steps into a row's fields, except value and row_id, which read a reference's own
+    keys.
+    """
+    node = row
+    for segment in path.split('.'):
+        if segment in ('value', 'row_id'):
+            node = node[segment]
+        else:
+            node = node['fields'][segment]
+    return node
+
+def index_by_row_id(rows):
+    """
+    Builds a hash index of rows by row_id. Later rows with the same row_id replace earlier ones.
+    """
+    return {row['row_id']: row for row in rows}
+
+def explode(rows, path, columns, parent_columns=None):
+    """
+    Turns each non-empty reference in an array field into a row of its own, keyed by the
+    referenced row_id, with fields taken from the reference and from the row that holds it.
+    """
+    parent_columns = parent_columns or {}
+    for row in rows:
+        parent_fields = {name: get_field(row, field) for name, field in parent_columns.items()}
+        for reference in get_field(row, path):
+            if reference['value'] == 0:
+                continue
+            fields = {name: get_field(reference, field) for name, field in columns.items()}
+            fields.update(parent_fields)
+            yield {'row_id': reference['value'], 'fields': fields}
+
+def check_contiguous(name, index):
+    """
+    Checks that a row_id index has a row for every row_id between its lowest and highest.
+    """
+    if not index:
+        return
+    low = min(index)
+    high = max(index)
+    missing = high - low + 1 - len(index)
+    if missing:
+        first = next(row_id for row_id in range(low, high + 1) if row_id not in index)
+        raise SheetGap(
+            f'{name} is missing {missing} rows between row_id {low} and {high}, from {first}'
+        )
+
+class SheetJoin:
+    """
+    Declares records built from a base sheet joined to other sheets on row_id.
+
+    Joins are given as (alias, rows, key path) and are applied in order: the key is read from
+    the base row, or from an earlier join when the path starts with its alias, and looked up in
+    a row_id index of the rows. Base rows without a match in every join are dropped, and counted
+    per join in unmatched. Joins named in contiguous are to sheets that have a row for every
+    row_id in their span, such as lookup tables, and the join fails if any are missing. Columns
+    map record keys to paths read the same way. Each index is built once, so running the join
+    is linear in the number of rows.
+    """
+    def __init__(self, joins, columns, contiguous=()):
+        self.joins = joins
+        self.columns = columns
+        self.contiguous = contiguous
+        self.unmatched = {}
+
+    def run(self, base_rows):
+        """
+        Yields a record for each base row that matches every join, and reports how many rows
+        were dropped once every base row has been read.
+        """
+        indexes = [(alias, index_by_row_id(rows), key) for alias, rows, key in self.joins]
+        for alias, index, _ in indexes:
+            if alias in self.contiguous:
+                check_contiguous(alias, index)
+        self.unmatched = {alias: 0 for alias, _, _ in indexes}
+        read = 0
+        for row in base_rows:
+            read += 1
+            joined = {}
+            for alias, index, key in indexes:
+                match = index.get(self.resolve(row, joined, key))
+                if match is None:
+                    self.unmatched[alias] += 1
+                    break
+                joined[alias] = match
+            else:
+                yield {name: self.resolve(row, joined, path) for name, path in self.columns.items()}
+        for alias, count in self.unmatched.items():
+            if count:
+                print(f'Dropped {count} of {read} rows without a match in {alias}')
+
+    @staticmethod
+    def resolve(row, joined, path):
+        """
+        Reads a path from the base row, or from a joined row when it starts with the join's alias.
+        """
+        alias, _, rest = path.partition('.')
+        if alias in joined and rest:
+            return get_field(joined[alias], rest)
+        return get_field(row, path)
+
+def gathering_item_join(gathering_points, conversion_table):
+    """
+    Declares how gathering items join to the gathering points that list them, for their
+    gathering type and level, and to the level conversion table, for their raw level. When
+    several gathering points list an item, the last one decides. The conversion table must
+    have a row for every level in its span.
+    """
+    return SheetJoin(
+        joins=[
+            (
+                'point',
+                explode(
+                    gathering_points,
+                    'Item',
+                    {'level': 'GatheringItemLevel.value'},
+                    {'type': 'GatheringType.value'}
+                ),
+                'row_id'
+            ),
+            ('conversion', conversion_table, 'point.level')
+        ],
+        columns={
+            'id': 'Item.value',
+            'level': 'conversion.GatheringItemLevel',
+            'type': 'point.type'
+        },
+        contiguous=('conversion',)
+    )
+
+def join_gathering_points(gathering_points):
+    """
+    Builds gathering items from gathering points whose item references have been expanded with
+    the item and converted level. Like the three-pass join, the last gathering point to list a
+    gathering item decides its type, and items come out in gathering item order.
+    """
+    joined_items = index_by_row_id(explode(
+        gathering_points,
+        'Item',
+        {'id': 'Item.value', 'level': 'GatheringItemLevel.GatheringItemLevel'},
+        {'type': 'GatheringType.value'}
+    ))
+    return [joined_items[gathering_item_id]['fields'] for gathering_item_id in sorted(joined_items)]
@@ -0,0 +1,164 @@
+"""
+Versioned snapshots of the data files, published by atomically flipping a current symlink.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from page_cache import write_atomically
+
+CURRENT = 'current'
+SNAPSHOTS = 'snapshots'
+MANIFEST = 'manifest.json'
+KEEP_SNAPSHOTS = 3
+
+class ManifestMismatch(ValueError):
+    """
+    Raised when a data file does not match the manifest of its snapshot.
+    """
+
+def current_snapshot(root):
+    """
+    Resolves the snapshot that the current symlink points at, or None if nothing has been
+    published yet. Reading every file through the resolved path keeps a reader on one snapshot
+    even if a newer one is published meanwhile.
+    """
+    link = os.path.join(root, CURRENT)
+    if not os.path.exists(link):
+        return None
+    return os.path.realpath(link)
+
+def create_snapshot(root):
+    """
+    Creates an empty snapshot directory, named after the current time so that snapshots sort
+    in the order they were built.
+    """
+    directory = os.path.join(root, SNAPSHOTS)
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    snapshot = tempfile.mkdtemp(prefix=f'{stamp}-', dir=directory)
+    os.chmod(snapshot, 0o755)
+    return snapshot
+
+def reuse_file(snapshot, path):
+    """
+    Carries a file over from an earlier snapshot, hard linking it where the filesystem allows.
+    """
+    target = os.path.join(snapshot, os.path.basename(path))
+    try:
+        os.link(path, target)
+    except OSError:
+        shutil.copyfile(path, target)
+
+def carry_over(snapshot, path, compressions=()):
+    """
+    Carries a data file over from an earlier snapshot, along with whichever of its compressed
+    siblings in the given formats exist.
+    """
+    reuse_file(snapshot, path)
+    for compression in compressions:
+        if os.path.exists(f'{path}.{compression}'):
+            reuse_file(snapshot, f'{path}.{compression}')
+
+def discard_snapshot(snapshot):
+    """
+    Removes a snapshot that will not be published.
+    """
+    shutil.rmtree(snapshot, ignore_errors=True)
+
+def describe_file(path, records):
+    """
+    Describes a data file for the manifest.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return {'sha256': digest.hexdigest(), 'bytes': os.path.getsize(path), 'records': records}
+
+def content_digest(files):
+    """
+    Digests the content of a snapshot from the digests of its JSON data files, leaving out
+    compressed siblings, so snapshots holding the same data have the same content digest.
+    """
+    digest = hashlib.sha256()
+    for file_name, description in sorted(files.items()):
+        if file_name.endswith('.json'):
+            digest.update(f'{file_name} {description["sha256"]}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+def write_manifest(snapshot, manifest, counts):
+    """
+    Describes every data file in a snapshot, with the record counts given per file name, and
+    the content of the snapshot as a whole, writes the manifest alongside them and returns it.
+    """
+    manifest = dict(manifest)
+    manifest['built_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    manifest['files'] = {
+        file_name: describe_file(os.path.join(snapshot, file_name), counts.get(file_name))
+        for file_name in sorted(os.listdir(snapshot))
+        if file_name != MANIFEST and not file_name.endswith('.tmp')
+    }
+    manifest['content_sha256'] = content_digest(manifest['files'])
+    write_atomically(os.path.join(snapshot, MANIFEST), json.dumps(manifest, indent=2))
+    return manifest
+
+def is_redundant(manifest, current_manifest, metadata_keys):
+    """
+    Checks whether a snapshot would change nothing if published: its content, its files and
+    the given upstream metadata all match the current snapshot's manifest.
+    """
+    return manifest['content_sha256'] == current_manifest.get('content_sha256') \
+        and set(manifest['files']) == set(current_manifest.get('files', {})) \
+        and all(manifest[key] == current_manifest.get(key) for key in metadata_keys)
+
+def read_manifest(snapshot):
+    """
+    Reads a snapshot's manifest, or an empty one if there is no snapshot.
+    """
+    if snapshot is None:
+        return {}
+    with open(os.path.join(snapshot, MANIFEST), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def read_verified(snapshot, manifest, file_name):
+    """
+    Reads a data file from a snapshot, checking its size and digest against the manifest.
+    """
+    with open(os.path.join(snapshot, file_name), 'rb') as f:
+        data = f.read()
+    expected = manifest.get('files', {}).get(file_name)
+    if expected is None or len(data) != expected['bytes'] \
+            or hashlib.sha256(data).hexdigest() != expected['sha256']:
+        raise ManifestMismatch(f'{file_name} does not match the manifest of {snapshot}')
+    return data
+
+def verify_file(snapshot, manifest, file_name):
+    """
+    Checks the size and digest of a data file in a snapshot against the manifest without
+    reading it into memory, and returns its path.
+    """
+    path = os.path.join(snapshot, file_name)
+    expected = manifest.get('files', {}).get(file_name)
+    described = describe_file(path, None)
+    if expected is None or described['bytes'] != expected['bytes'] \
+            or described['sha256'] != expected['sha256']:
+        raise ManifestMismatch(f'{file_name} does not match the manifest of {snapshot}')
+    return path
+
+def publish_snapshot(root, snapshot, keep=KEEP_SNAPSHOTS):
+    """
+    Points the current symlink at a snapshot with a single atomic rename, then removes all but
+    the newest snapshots.
+    """
+    link = os.path.join(root, CURRENT)
+    temp_link = f'{link}.{os.getpid()}.tmp'
+    os.symlink(os.path.relpath(snapshot, root), temp_link)
+    os.replace(temp_link, link)
+    directory = os.path.join(root, SNAPSHOTS)
+    for name in sorted(os.listdir(directory))[:-keep]:
+        path = os.path.join(directory, name)
+        if os.path.realpath(path) != os.path.realpath(snapshot):
+            shutil.rmtree(path, ignore_errors=True)
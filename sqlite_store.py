@@ -0,0 +1,123 @@
+"""
+An SQLite copy of the data files, with a table per category ordered for level range queries.
+"""
+import json
+import os
+import sqlite3
+from pathlib import Path
+
+DATABASE = 'items.sqlite'
+CATEGORIES = ('mining', 'botany', 'fishing', 'crafting')
+
+def write_database(path, outputs):
+    """
+    Writes the records of each category into a new SQLite database, with a craft_type column for
+    crafting items, whose records are grouped by craft type. Each table's primary key, (level, id)
+    or (craft_type, level, id), covers every column, and tables are stored without rowids, so a
+    table is its own covering index and range scans read nothing else.
+    """
+    temp_path = f'{path}.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    try:
+        with connection:
+            for category in CATEGORIES:
+                if category == 'crafting':
+                    connection.execute(
+                        'CREATE TABLE crafting (craft_type TEXT NOT NULL, id INTEGER NOT NULL, '
+                        'level INTEGER NOT NULL, PRIMARY KEY (craft_type, level, id)) WITHOUT ROWID'
+                    )
+                    connection.executemany(
+                        'INSERT INTO crafting VALUES (?, ?, ?)',
+                        (
+                            (craft_type, record['id'], record['level'])
+                            for craft_type, records in outputs[category].items()
+                            for record in records
+                        )
+                    )
+                else:
+                    connection.execute(
+                        f'CREATE TABLE {category} (id INTEGER NOT NULL, level INTEGER NOT NULL, '
+                        f'PRIMARY KEY (level, id)) WITHOUT ROWID'
+                    )
+                    connection.executemany(
+                        f'INSERT INTO {category} VALUES (?, ?)',
+                        ((record['id'], record['level']) for record in outputs[category])
+                    )
+    finally:
+        connection.close()
+    os.replace(temp_path, path)
+
+def write_snapshot_database(snapshot):
+    """
+    Writes the database of a snapshot from its data files, whether pulled, streamed or carried
+    over.
+    """
+    outputs = {}
+    for category in CATEGORIES:
+        with open(os.path.join(snapshot, f'{category}.json'), 'r', encoding='utf-8') as f:
+            outputs[category] = json.load(f)
+    write_database(os.path.join(snapshot, DATABASE), outputs)
+
+def level_range_filter(category, craft_type):
+    """
+    Builds the FROM and WHERE clauses selecting a category's items within a level range, and
+    the parameters they take besides the levels.
+    """
+    if category not in CATEGORIES:
+        raise ValueError(f'Unknown category {category}')
+    if category == 'crafting':
+        return 'FROM crafting WHERE craft_type = ? AND level BETWEEN ? AND ?', (craft_type,)
+    return f'FROM {category} WHERE level BETWEEN ? AND ?', ()
+
+class ItemDatabase:
+    """
+    Answers level range queries from a snapshot's SQLite database over a read-only connection.
+    Published snapshots never change, so the database is opened as immutable and read without
+    locking.
+    """
+    def __init__(self, path):
+        self.connection = sqlite3.connect(
+            f'{Path(path).resolve().as_uri()}?mode=ro&immutable=1',
+            uri=True,
+            check_same_thread=False
+        )
+
+    def item_ids(self, category, min_level, max_level, craft_type=None):
+        """
+        Retrieves the ids of a category's items within a level range, ordered by level and id.
+        """
+        clauses, parameters = level_range_filter(category, craft_type)
+        return [
+            item_id for (item_id,) in self.connection.execute(
+                f'SELECT id {clauses} ORDER BY level, id',
+                parameters + (min_level, max_level)
+            )
+        ]
+
+    def count_items(self, category, min_level, max_level, craft_type=None):
+        """
+        Counts a category's items within a level range.
+        """
+        clauses, parameters = level_range_filter(category, craft_type)
+        return self.connection.execute(
+            f'SELECT COUNT(*) {clauses}',
+            parameters + (min_level, max_level)
+        ).fetchone()[0]
+
+    def craft_types(self):
+        """
+        Retrieves the craft types that have crafting items, in sorted order.
+        """
+        return [
+            craft_type for (craft_type,) in self.connection.execute(
+                'SELECT DISTINCT craft_type FROM crafting ORDER BY craft_type'
+            )
+        ]
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        self.connection.close()
@@ -0,0 +1,30 @@
+"""
+Runs the stages of a pull concurrently, each once the stages it depends on are done.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+STAGE_WORKERS = 5
+
+def run_stages(stages, max_workers=STAGE_WORKERS):
+    """
+    Runs stages on a thread pool, starting each one as soon as all of its dependencies are done.
+    Stages are given as {name: (function, args, dependency names)}.
+    """
+    pending = dict(stages)
+    running = {}
+    done = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            ready = [
+                name for name, (_, _, dependencies) in pending.items()
+                if all(dependency in done for dependency in dependencies)
+            ]
+            for name in ready:
+                function, args, _ = pending.pop(name)
+                running[executor.submit(function, *args)] = name
+            if not running:
+                raise ValueError(f'Stages with unsatisfiable dependencies: {", ".join(pending)}')
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                future.result()
+                done.add(running.pop(future))
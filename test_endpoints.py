@@ -0,0 +1,104 @@
+"""
+Tests pulls spread over several stand-ins: choosing endpoints, hedging slow requests, and
+failing pages.
+"""
+import os
+import socket
+import time
+import pytest
+from conftest import pull, read_data_files
+from endpoints import EndpointPool
+from page_fetcher import PageUnavailable
+from pull_data import Puller
+from snapshots import SNAPSHOTS, current_snapshot
+
+@pytest.mark.covers('user-022')
+def test_requests_go_to_the_fastest_endpoint(serve, tmp_path):
+    """
+    Once both endpoints are measured, most requests go to the faster one.
+    """
+    slow = serve(latency=0.05)
+    fast = serve()
+    pull(tmp_path, xivapi_url=slow.url, mirror_urls=[fast.url])
+    assert fast.counts['requests'] > 2 * slow.counts['requests']
+
+@pytest.mark.covers('user-022')
+def test_slow_requests_are_hedged(serve, tmp_path):
+    """
+    Requests that take longer than an endpoint usually does are sent to another endpoint too,
+    without changing the data files.
+    """
+    jittery = serve(latency=0.01, jitter=0.03, seed=1)
+    steady = serve(latency=0.02)
+    dataset = pull(tmp_path / 'hedged', xivapi_url=jittery.url, mirror_urls=[steady.url])
+    assert dataset.report['hedges']['sent'] > 0
+    pull(tmp_path / 'direct', xivapi_url=steady.url)
+    assert read_data_files(tmp_path / 'hedged') == read_data_files(tmp_path / 'direct')
+
+@pytest.mark.covers('user-022')
+def test_failed_page_is_retried_on_another_endpoint(serve, tmp_path):
+    """
+    A page that one endpoint keeps failing is pulled from another, with no more attempts than
+    one failure leaves.
+    """
+    failing = serve(failing_pages=[('FishingSpot', None)])
+    mirror = serve(latency=0.01)
+    pull(tmp_path / 'mirrored', xivapi_url=failing.url, mirror_urls=[mirror.url])
+    pull(tmp_path / 'direct', xivapi_url=mirror.url)
+    assert read_data_files(tmp_path / 'mirrored') == read_data_files(tmp_path / 'direct')
+
+@pytest.mark.covers('user-022')
+def test_dead_primary_fails_over_to_a_mirror(serve, tmp_path):
+    """
+    The version and schema probes, like pages, are retried on a mirror when the primary
+    endpoint cannot be reached.
+    """
+    with socket.socket() as dead:
+        dead.bind(('127.0.0.1', 0))
+        dead_url = f'http://127.0.0.1:{dead.getsockname()[1]}'
+    mirror = serve()
+    pull(tmp_path / 'mirrored', xivapi_url=dead_url, mirror_urls=[mirror.url])
+    pull(tmp_path / 'direct', xivapi_url=mirror.url)
+    assert read_data_files(tmp_path / 'mirrored') == read_data_files(tmp_path / 'direct')
+
+@pytest.mark.covers('user-022')
+def test_failed_page_aborts_the_pull(serve, tmp_path):
+    """
+    A page that every endpoint keeps failing aborts the pull, and the current snapshot is
+    left as it was.
+    """
+    healthy = serve()
+    pull(tmp_path, xivapi_url=healthy.url)
+    snapshot = current_snapshot(str(tmp_path))
+    failing_pages = [('FishingSpot', None)]
+    first = serve(failing_pages=failing_pages)
+    second = serve(failing_pages=failing_pages)
+    puller = Puller(
+        xivapi_url=first.url,
+        mirror_urls=[second.url],
+        data_dir=str(tmp_path),
+        max_attempts=2
+    )
+    with pytest.raises(PageUnavailable):
+        puller.pull(force=True)
+    puller.fetcher.session.close()
+    assert current_snapshot(str(tmp_path)) == snapshot
+    assert os.listdir(tmp_path / SNAPSHOTS) == [os.path.basename(snapshot)]
+
+@pytest.mark.covers('user-022')
+def test_idle_endpoints_are_tried_again():
+    """
+    Endpoints are tried once before they are compared, and again once their samples expire,
+    however slow or unhealthy they were.
+    """
+    pool = EndpointPool(['http://slow', 'http://fast'], max_age=0.1)
+    slow, fast = pool.endpoints
+    assert pool.choose() is slow
+    assert pool.choose() is fast
+    slow.record(1.0, failed=True)
+    fast.record(0.01, failed=False)
+    assert pool.choose() is fast
+    time.sleep(0.2)
+    fast.record(0.01, failed=False)
+    assert pool.choose() is slow
+    assert pool.choose() is fast
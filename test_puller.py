@@ -0,0 +1,217 @@
+"""
+Tests pulls against the local XIVAPI stand-in: skipping unchanged sheets, and every way of
+pulling giving the same data files.
+"""
+import csv
+import os
+import pytest
+from cassette import Cassette
+from conftest import DATA_FILES, pull, read_data_files
+from fake_xivapi import CRAFT_TYPES, GAME_VERSION
+from page_cache import PageCache
+from snapshots import current_snapshot, read_manifest
+
+def write_csv(directory, sheet_name, columns, types, rows):
+    """
+    Writes a sheet in the layout of the datamining CSV exports.
+    """
+    with open(os.path.join(directory, f'{sheet_name}.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['key'] + [str(index) for index in range(len(columns))])
+        writer.writerow(['#'] + columns)
+        writer.writerow(['int32'] + types)
+        writer.writerows(rows)
+
+def write_csv_exports(directory, sheets):
+    """
+    Writes the stand-in's sheets as datamining CSV exports.
+    """
+    os.makedirs(directory)
+    write_csv(
+        directory,
+        'GatheringItemLevelConvertTable',
+        ['GatheringItemLevel', 'Stars'],
+        ['byte', 'byte'],
+        [
+            [row['row_id'], row['fields']['GatheringItemLevel'], row['fields']['Stars']]
+            for row in sheets['GatheringItemLevelConvertTable']
+        ]
+    )
+    write_csv(
+        directory,
+        'GatheringItem',
+        ['Item', 'GatheringItemLevel'],
+        ['int32', 'GatheringItemLevelConvertTable'],
+        [
+            [
+                row['row_id'],
+                row['fields']['Item']['value'],
+                row['fields']['GatheringItemLevel']['value']
+            ]
+            for row in sheets['GatheringItem']
+        ]
+    )
+    write_csv(
+        directory,
+        'GatheringPointBase',
+        ['GatheringType', 'GatheringLevel'] + [f'Item[{index}]' for index in range(8)],
+        ['GatheringType', 'byte'] + ['int32'] * 8,
+        [
+            [
+                row['row_id'],
+                row['fields']['GatheringType']['value'],
+                row['fields']['GatheringLevel']
+            ] + [item['value'] for item in row['fields']['Item']]
+            for row in sheets['GatheringPointBase']
+        ]
+    )
+    write_csv(
+        directory,
+        'FishingSpot',
+        ['GatheringLevel'] + [f'Item[{index}]' for index in range(10)],
+        ['byte'] + ['Item'] * 10,
+        [
+            [row['row_id'], row['fields']['GatheringLevel']]
+            + [item['value'] for item in row['fields']['Item']]
+            for row in sheets['FishingSpot']
+        ]
+    )
+    write_csv(
+        directory,
+        'Recipe',
+        ['CraftType', 'RecipeLevelTable', 'Item{Result}', 'Amount{Result}'] + [
+            column for index in range(8)
+            for column in (f'Item{{Ingredient}}[{index}]', f'Amount{{Ingredient}}[{index}]')
+        ],
+        ['CraftType', 'RecipeLevelTable', 'Item', 'byte'] + ['Item', 'byte'] * 8,
+        [
+            [
+                row['row_id'],
+                row['fields']['CraftType']['value'],
+                row['fields']['RecipeLevelTable']['value'],
+                row['fields']['ItemResult']['value'],
+                row['fields']['AmountResult']
+            ] + [
+                value
+                for ingredient, amount in zip(
+                    row['fields']['Ingredient'],
+                    row['fields']['AmountIngredient']
+                )
+                for value in (ingredient['value'], amount)
+            ]
+            for row in sheets['Recipe']
+        ]
+    )
+    write_csv(
+        directory,
+        'CraftType',
+        ['Name'],
+        ['str'],
+        [[index, name] for index, name in enumerate(CRAFT_TYPES)]
+    )
+    write_csv(
+        directory,
+        'RecipeLevelTable',
+        ['ClassJobLevel'],
+        ['byte'],
+        [[level, level] for level in range(101)]
+    )
+    with open(os.path.join(directory, 'ffxivgame.ver'), 'w', encoding='utf-8') as f:
+        f.write(GAME_VERSION)
+
+@pytest.mark.covers('user-004')
+def test_unchanged_sheets_are_skipped(stand_in, tmp_path):
+    """
+    A second pull of the same game version and schema pulls nothing and keeps the snapshot.
+    """
+    pull(tmp_path, xivapi_url=stand_in.url)
+    snapshot = current_snapshot(str(tmp_path))
+    requests = stand_in.counts['requests']
+    dataset = pull(tmp_path, xivapi_url=stand_in.url)
+    assert not dataset.refreshed
+    assert current_snapshot(str(tmp_path)) == snapshot
+    assert stand_in.counts['requests'] - requests <= 2
+
+@pytest.mark.covers('user-004')
+def test_schema_change_pulls_again(stand_in, tmp_path):
+    """
+    A new schema in the same game version pulls every sheet again and publishes it.
+    """
+    pull(tmp_path, xivapi_url=stand_in.url)
+    snapshot = current_snapshot(str(tmp_path))
+    data_files = read_data_files(tmp_path)
+    stand_in.schema = 'exdschema@changed'
+    dataset = pull(tmp_path, xivapi_url=stand_in.url)
+    assert set(DATA_FILES) <= dataset.refreshed
+    assert current_snapshot(str(tmp_path)) != snapshot
+    assert read_data_files(tmp_path) == data_files
+
+@pytest.mark.covers('user-005')
+def test_schema_change_is_not_served_from_the_page_cache(stand_in, tmp_path):
+    """
+    Pages cached for an earlier schema are removed rather than served for a new one.
+    """
+    page_cache = PageCache(str(tmp_path / 'cache'))
+    pull(tmp_path / 'data', xivapi_url=stand_in.url, page_cache=page_cache)
+    stand_in.schema = 'exdschema@changed'
+    requests = stand_in.counts['requests']
+    pull(tmp_path / 'data', xivapi_url=stand_in.url, page_cache=page_cache)
+    assert stand_in.counts['requests'] - requests > 2
+    assert read_manifest(current_snapshot(str(tmp_path / 'data')))['schema'] == stand_in.schema
+    assert len(os.listdir(tmp_path / 'cache' / 'pages')) == 1
+
+@pytest.mark.covers('user-004')
+def test_latest_version_is_never_skipped(stand_in, tmp_path):
+    """
+    While only the latest version is listed, nothing counts as unchanged.
+    """
+    stand_in.game_version = None
+    pull(tmp_path, xivapi_url=stand_in.url)
+    dataset = pull(tmp_path, xivapi_url=stand_in.url)
+    assert set(DATA_FILES) <= dataset.refreshed
+
+@pytest.mark.covers('user-007')
+def test_stream_matches_batch(stand_in, tmp_path):
+    """
+    Streaming writes the same data files as holding whole sheets.
+    """
+    pull(tmp_path / 'batch', xivapi_url=stand_in.url)
+    pull(tmp_path / 'stream', xivapi_url=stand_in.url, stream=True)
+    assert read_data_files(tmp_path / 'stream') == read_data_files(tmp_path / 'batch')
+
+@pytest.mark.covers('user-011')
+def test_joined_gathering_matches_three_pass(stand_in, tmp_path):
+    """
+    The single crawl of gathering points gives the same data files as the three-pass join.
+    """
+    pull(tmp_path / 'three-pass', xivapi_url=stand_in.url)
+    pull(tmp_path / 'joined', xivapi_url=stand_in.url, joined_gathering=True)
+    assert read_data_files(tmp_path / 'joined') == read_data_files(tmp_path / 'three-pass')
+
+@pytest.mark.covers('user-023')
+def test_csv_matches_api(stand_in, sheets, tmp_path):
+    """
+    Reading the sheets from CSV exports gives the same data files as crawling XIVAPI.
+    """
+    write_csv_exports(str(tmp_path / 'csv'), sheets)
+    pull(tmp_path / 'api', xivapi_url=stand_in.url)
+    pull(tmp_path / 'csv-data', csv_dir=str(tmp_path / 'csv'))
+    assert read_data_files(tmp_path / 'csv-data') == read_data_files(tmp_path / 'api')
+
+@pytest.mark.covers('user-009')
+def test_replay_matches_live(stand_in, tmp_path):
+    """
+    Replaying a recorded cassette gives the same data files as the live pull, without
+    sending a request.
+    """
+    cassette_dir = str(tmp_path / 'cassette')
+    pull(tmp_path / 'live', xivapi_url=stand_in.url, cassette=Cassette(cassette_dir))
+    requests = stand_in.counts['requests']
+    pull(
+        tmp_path / 'replay',
+        force=True,
+        xivapi_url=stand_in.url,
+        cassette=Cassette(cassette_dir, replaying=True)
+    )
+    assert stand_in.counts['requests'] == requests
+    assert read_data_files(tmp_path / 'replay') == read_data_files(tmp_path / 'live')
@@ -0,0 +1,89 @@
+"""
+Tests building recipe ingredient trees: how many crafts each ingredient takes, the raw materials
+of each recipe, and recipes that need each other.
+"""
+import copy
+import pytest
+from recipe_trees import build_recipes
+
+def recipe(ingredients, recipe_yield=1, level=1):
+    """
+    Makes a recipe from {ingredient id: amount}.
+    """
+    return {
+        'craft_type': 'Weaver',
+        'level': level,
+        'yield': recipe_yield,
+        'ingredients': [
+            {'id': item_id, 'amount': amount} for item_id, amount in ingredients.items()
+        ]
+    }
+
+def expand_materials(recipes, item_id):
+    """
+    Counts the raw materials one craft of an item's recipe needs by expanding every ingredient
+    all the way down, without sharing any counts between recipes.
+    """
+    totals = {}
+    for ingredient in recipes[item_id]['ingredients']:
+        if ingredient['id'] in recipes:
+            crafts = -(-ingredient['amount'] // recipes[ingredient['id']]['yield'])
+            for material, amount in expand_materials(recipes, ingredient['id']).items():
+                totals[material] = totals.get(material, 0) + amount * crafts
+        else:
+            totals[ingredient['id']] = totals.get(ingredient['id'], 0) + ingredient['amount']
+    return totals
+
+@pytest.mark.covers('user-024')
+def test_crafts_round_up_when_a_recipe_yields_several():
+    """
+    An ingredient whose recipe yields more than one is crafted just often enough, and the
+    materials count every craft in full.
+    """
+    recipes = build_recipes({
+        1: recipe({2: 5}),
+        2: recipe({3: 2}, recipe_yield=3)
+    })
+    assert recipes[1]['ingredients'] == [{'id': 2, 'amount': 5, 'crafts': 2}]
+    assert recipes[1]['materials'] == [{'id': 3, 'amount': 4}]
+    assert recipes[2]['materials'] == [{'id': 3, 'amount': 2}]
+
+@pytest.mark.covers('user-024')
+def test_materials_match_a_recursive_expansion():
+    """
+    The materials of every recipe, counted once per recipe and shared, match expanding each
+    recipe all the way down on its own.
+    """
+    recipes = {
+        1: recipe({2: 3, 3: 1, 10: 4}),
+        2: recipe({4: 2, 11: 1}, recipe_yield=2),
+        3: recipe({4: 5, 2: 1, 12: 3}),
+        4: recipe({13: 2, 14: 1}, recipe_yield=3),
+        5: recipe({1: 2, 4: 7, 13: 1})
+    }
+    built = build_recipes(copy.deepcopy(recipes))
+    for item_id in recipes:
+        assert {
+            material['id']: material['amount'] for material in built[item_id]['materials']
+        } == expand_materials(recipes, item_id)
+
+@pytest.mark.covers('user-024')
+def test_recipes_that_need_each_other_are_counted_once():
+    """
+    Two recipes that need each other are built without recursing forever, with the recipe
+    that would close the cycle counted as a raw material.
+    """
+    recipes = build_recipes({
+        1: recipe({2: 1, 10: 1}),
+        2: recipe({1: 2, 11: 3})
+    })
+    assert recipes[1]['ingredients'] == [
+        {'id': 2, 'amount': 1, 'crafts': 1},
+        {'id': 10, 'amount': 1}
+    ]
+    assert recipes[2]['ingredients'] == [{'id': 1, 'amount': 2}, {'id': 11, 'amount': 3}]
+    assert recipes[1]['materials'] == [
+        {'id': 1, 'amount': 2},
+        {'id': 10, 'amount': 1},
+        {'id': 11, 'amount': 3}
+    ]
@@ -0,0 +1,106 @@
+"""
+Tests the web server's answers from the data it serves.
+"""
+import asyncio
+import threading
+import pytest
+import requests
+import tornado.httpserver
+import tornado.netutil
+import server
+from conftest import pull
+from recipe_trees import build_recipes
+
+LEVEL_RANGES = (('1', '100'), ('10', '20'), ('50', '50'), ('90', '1'))
+
+@pytest.fixture(name='get')
+def fixture_get():
+    """
+    Serves the server's application from a background thread until the test is done, and
+    returns a function that sends it GET requests.
+    """
+    sockets = tornado.netutil.bind_sockets(0, '127.0.0.1')
+    url = f'http://127.0.0.1:{sockets[0].getsockname()[1]}'
+    loop = asyncio.new_event_loop()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        tornado.httpserver.HTTPServer(server.make_application()).add_sockets(sockets)
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    with requests.Session() as session:
+        yield lambda path: session.get(f'{url}{path}', timeout=10)
+    loop.call_soon_threadsafe(loop.stop)
+
+@pytest.mark.covers('user-024')
+def test_recipe_handler_expands_ingredient_trees(get):
+    """
+    A recipe is answered with the recipes of its crafted ingredients nested in it, an unknown
+    item with 404 and a language without names with 400.
+    """
+    server.served.use({
+        'botany': [],
+        'mining': [],
+        'fishing': [],
+        'crafting': {},
+        'names': None,
+        'recipes': build_recipes({
+            1: {
+                'craft_type': 'Weaver',
+                'level': 10,
+                'yield': 1,
+                'ingredients': [{'id': 2, 'amount': 3}, {'id': 10, 'amount': 1}]
+            },
+            2: {
+                'craft_type': 'Weaver',
+                'level': 5,
+                'yield': 2,
+                'ingredients': [{'id': 11, 'amount': 2}]
+            }
+        })
+    })
+    response = get('/rest/recipe/1')
+    assert response.status_code == 200
+    tree = response.json()
+    assert tree['ingredients'][0]['crafts'] == 2
+    assert tree['ingredients'][0]['recipe']['ingredients'] == [{'id': 11, 'amount': 2}]
+    assert 'recipe' not in tree['ingredients'][1]
+    assert tree['materials'] == [{'id': 10, 'amount': 1}, {'id': 11, 'amount': 4}]
+    assert get('/rest/recipe/3').status_code == 404
+    assert get('/rest/recipe/1?lang=en').status_code == 400
+
+def read_answers(get):
+    """
+    Finds the items and item counts of every category and craft type, including an unknown
+    one, in a few level ranges, along with the craft types.
+    """
+    craft_types = get('/rest/crafting-types/').json()
+    answers = {'craft_types': craft_types}
+    for category in ('botany', 'mining', 'fishing', 'crafting'):
+        for craft_type in craft_types + ['Unknown'] if category == 'crafting' else [None]:
+            for min_level, max_level in LEVEL_RANGES:
+                answers[category, craft_type, min_level, max_level] = (
+                    server.find_items(category, min_level, max_level, craft_type),
+                    server.count_items(category, min_level, max_level, craft_type)
+                )
+    answers['unknown'] = get('/rest/crafting-items/Unknown/1-100').json()
+    return answers
+
+@pytest.mark.covers('user-020')
+def test_sqlite_answers_match_json(get, stand_in, tmp_path, monkeypatch):
+    """
+    Serving from the SQLite database of a pull answers every query as serving its JSON data
+    files does, including craft types that have no items.
+    """
+    monkeypatch.chdir(tmp_path)
+    pull(tmp_path / server.DATA_DIR, xivapi_url=stand_in.url, sqlite=True)
+    answers = []
+    for sqlite in (False, True):
+        _, items = server.read_current_snapshot(sqlite)
+        server.served.use(items)
+        answers.append(read_answers(get))
+    server.served.use({'botany': [], 'mining': [], 'fishing': [], 'crafting': {}})
+    assert answers[0] == answers[1]
+    assert len(answers[0]['craft_types']) > 1
+    assert answers[0]['unknown'] == []
@@ -0,0 +1,176 @@
+"""
+Rate limiting, adaptive concurrency, backoff and circuit breaking for XIVAPI requests.
+"""
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+RATE_LIMIT = 20
+RATE_BURST = 20
+INITIAL_CONCURRENCY = 4
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 16
+LATENCY_TOLERANCE = 4
+BASELINE_SAMPLES = 50
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+
+class TokenBucket:
+    """
+    Limits requests to a steady rate, allowing short bursts. Callers that find the bucket empty
+    reserve a future token and sleep until it is due.
+    """
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, waiting for one if necessary.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+class AimdWindow:
+    """
+    Limits the number of requests in flight with additive increase, multiplicative decrease.
+    The window grows by one request per window of healthy responses, and halves at most once per
+    round trip when a response is throttled, fails, or is much slower than its baseline: the
+    fastest of the recent responses of the same kind, such as pages of the same size. Keeping
+    a baseline per kind stops small requests from making large ones look congested, and
+    keeping it over recent responses only lets it follow an upstream that has slowed for good.
+    """
+    def __init__(
+        self,
+        initial=INITIAL_CONCURRENCY,
+        minimum=MIN_CONCURRENCY,
+        maximum=MAX_CONCURRENCY
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.baselines = {}
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Waits for room in the window and takes a slot.
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, congested=False, kind=None):
+        """
+        Frees a slot, adjusting the window from the response's latency, compared with the
+        baseline for its kind of request, and whether it showed congestion.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if not congested:
+                samples = self.baselines.setdefault(kind, deque(maxlen=BASELINE_SAMPLES))
+                samples.append(latency)
+                congested = latency > min(samples) * LATENCY_TOLERANCE
+            if congested:
+                if now - self.last_decrease > latency:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+class CircuitBreaker:
+    """
+    Stops requests to a host after repeated failures. Once open, requests wait out the reset
+    timeout, then a single trial request decides whether the breaker closes or opens again.
+    """
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        """
+        Checks whether requests to the host are currently being held back.
+        """
+        with self.lock:
+            return self.opened_at is not None
+
+    def wait_until_allowed(self):
+        """
+        Waits until a request may be sent to the host.
+        """
+        while True:
+            with self.lock:
+                if self.opened_at is None:
+                    return
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining <= 0 and not self.trial_in_flight:
+                    self.trial_in_flight = True
+                    return
+            time.sleep(max(remaining, 0.1))
+
+    def record_success(self):
+        """
+        Records a successful request, closing the breaker.
+        """
+        with self.lock:
+            if self.opened_at is not None:
+                print(f'Circuit for {self.name} closed')
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        """
+        Records a failed request, opening the breaker once failures reach the threshold.
+        """
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f'Circuit for {self.name} opened after {self.failures} failures')
+                self.opened_at = time.monotonic()
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """
+    Calculates an exponential backoff delay with full jitter for a retry attempt.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def parse_retry_after(value):
+    """
+    Parses a Retry-After header given in seconds or as an HTTP date, or returns None.
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,79 @@
+"""
+Shared HTTP session for XIVAPI requests, with pooled keep-alive connections and compression.
+"""
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+HOST_POOLS = 4
+MAX_CONNECTIONS_PER_HOST = 16
+
+class XivapiSession:
+    """
+    Wraps a requests session whose connection pool is shared by every sheet fetcher. Connections
+    are kept alive between pages, responses are negotiated with every compression urllib3 can
+    decode, and each host is limited to a fixed number of connections. A pool is kept for each
+    of the given number of hosts, so that no host's pool is evicted while requests go to all of
+    them.
+    """
+    def __init__(self, max_connections_per_host=MAX_CONNECTIONS_PER_HOST, hosts=1):
+        self.adapter = HTTPAdapter(
+            pool_connections=max(HOST_POOLS, hosts),
+            pool_maxsize=max_connections_per_host,
+            pool_block=True
+        )
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        self.lock = threading.Lock()
+        self.requests_made = 0
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self.retries = 0
+
+    def get(self, url, timeout):
+        """
+        Retrieves a URL through the pool, reading the whole body and counting its bytes.
+        """
+        response = self.session.get(url, timeout=timeout)
+        content = response.content
+        with self.lock:
+            self.requests_made += 1
+            self.wire_bytes += response.raw.tell()
+            self.decoded_bytes += len(content)
+        return response
+
+    def record_retry(self):
+        """
+        Counts a request that had to be retried.
+        """
+        with self.lock:
+            self.retries += 1
+
+    def connections_opened(self):
+        """
+        Counts the connections opened across every host pool.
+        """
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def stats(self):
+        """
+        Reports connection and transfer counts for the session.
+        """
+        with self.lock:
+            return {
+                'connections_opened': self.connections_opened(),
+                'requests': self.requests_made,
+                'retries': self.retries,
+                'wire_bytes': self.wire_bytes,
+                'decoded_bytes': self.decoded_bytes
+            }
+
+    def close(self):
+        """
+        Closes every pooled connection.
+        """
+        self.session.close()